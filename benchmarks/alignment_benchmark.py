@@ -0,0 +1,74 @@
+import argparse
+import io
+import time
+import zipfile
+import numpy as np
+from PIL import Image
+
+import preprocess
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--zipfile', default='', type=str, help='zipfile containing face dataset')
+parser.add_argument('--samples', default=500, type=int, help='number of images used from the zipfile')
+parser.add_argument('--upsamples', default='0,1', type=str, help='comma separated numbers of upsampling steps')
+parser.add_argument('--scales', default='1.0,0.75,0.5', type=str, help='comma separated detection scales')
+parser.add_argument('--batch_size', default=16, type=int, help='number of same-size images detected at once')
+
+
+def main():
+    global args
+    args = parser.parse_args()
+
+    if not args.zipfile:
+        raise ValueError('Please specify zipfile containing face dataset')
+
+    images = load_images(args.zipfile, args.samples)
+    upsamples = [int(x) for x in args.upsamples.split(',')]
+    scales = [float(x) for x in args.scales.split(',')]
+
+    # the current preprocessing path, one image per call with one upsampling step, is the reference
+    elapsed, reference = time_detection(lambda: [preprocess.detect_faces([image])[0] for image in images])
+    print('{:>8} {:>8} {:>8} {:>12} {:>12} {:>10}'.format('mode', 'upsample', 'scale', 'images/s', 'retention', 'mean IoU'))
+    print_row('single', 1, 1.0, elapsed, reference, reference)
+    for upsample in upsamples:
+        for scale in scales:
+            elapsed, dets = time_detection(lambda: preprocess.detect_faces(images, upsample, scale, args.batch_size))
+            print_row('batched', upsample, scale, elapsed, dets, reference)
+
+
+def load_images(path, samples):
+    with zipfile.ZipFile(path, 'r') as zf:
+        filenames = [name for name in zf.namelist() if not name.endswith('/')][:samples]
+        return [np.array(Image.open(io.BytesIO(zf.read(filename)))) for filename in filenames]
+
+
+def time_detection(function):
+    start = time.perf_counter()
+    dets = function()
+    return time.perf_counter() - start, dets
+
+
+def print_row(mode, upsample, scale, elapsed, dets, reference):
+    retention = sum(1 for image_dets in dets if image_dets) / len(dets)
+    # agreement with the reference is measured on the most confident face of images where both found one
+    ious = [iou(best_rect(image_dets), best_rect(reference_dets))
+            for image_dets, reference_dets in zip(dets, reference) if image_dets and reference_dets]
+    mean_iou = np.mean(ious) if ious else 0
+    print('{:>8} {:>8} {:>8.2f} {:>12.2f} {:>11.2f}% {:>10.3f}'
+          .format(mode, upsample, scale, len(dets) / elapsed, retention * 100, mean_iou))
+
+
+def best_rect(dets):
+    return max(dets, key=lambda det: det[1])[0]
+
+
+def iou(a, b):
+    width = min(a.right(), b.right()) - max(a.left(), b.left())
+    height = min(a.bottom(), b.bottom()) - max(a.top(), b.top())
+    intersection = max(width, 0) * max(height, 0)
+    union = a.width() * a.height() + b.width() * b.height() - intersection
+    return intersection / union if union > 0 else 0
+
+
+if __name__ == '__main__':
+    main()
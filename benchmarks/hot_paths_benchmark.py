@@ -0,0 +1,289 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import tempfile
+import time
+import zipfile
+import dlib
+import numpy as np
+from PIL import Image
+
+from controller.face_detector import FaceDetector
+from controller.face_recognizer import FaceRecognizer
+from controller.frame_controller import FrameController
+from controller.inference_engine import InferenceEngine
+from model.db_handler import DBHandler
+from model.face_model import Face
+from model.gallery import Gallery, AGGREGATIONS
+from utils.zipfile_data_generator import DataHolder, DataGenerator
+from utils.packed_data_generator import PackedDataGenerator, pack_dataset
+from utils.prefetcher import PrefetchingGenerator
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--output', default='benchmark_results.json', type=str, help='path to write JSON results')
+parser.add_argument('--repeats', default=20, type=int, help='number of timed calls per case')
+parser.add_argument('--dim', default=256, type=int, help='length of synthetic feature vectors')
+parser.add_argument('--gallery_sizes', default='100,1000,10000', type=str, help='comma separated gallery sizes')
+parser.add_argument('--face_counts', default='1,4,16', type=str, help='comma separated numbers of faces per frame')
+parser.add_argument('--resolutions', default='640x480,1280x720,1920x1080', type=str, help='comma separated frame sizes')
+parser.add_argument('--seed', default=0, type=int, help='seed of synthetic data')
+
+
+class SyntheticEngine:
+    # stands in for InferenceEngine so that no trained weights or landmark model are needed
+    def __init__(self, dim, seed):
+        self.dim = dim
+        self.rng = np.random.default_rng(seed)
+
+    def get_feature_vectors(self, batch):
+        return self.rng.standard_normal((len(batch), self.dim)).astype(np.float32)
+
+    def get_landmarks(self, img, rect):
+        w, h = rect.width(), rect.height()
+        points = [(0.70, 0.38), (0.58, 0.38), (0.30, 0.38), (0.42, 0.38), (0.50, 0.60)]
+        return dlib.full_object_detection(rect, dlib.points([dlib.point(int(x * w), int(y * h)) for x, y in points]))
+
+
+def main():
+    global args
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+    gallery_sizes = [int(x) for x in args.gallery_sizes.split(',')]
+    face_counts = [int(x) for x in args.face_counts.split(',')]
+    resolutions = [tuple(int(v) for v in x.split('x')) for x in args.resolutions.split(',')]
+
+    results = list()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results += bench_detection(rng, resolutions)
+        results += bench_compare_faces(rng)
+        results += bench_face_correlation(rng, tmp_dir, face_counts)
+        results += bench_load_identities(rng, tmp_dir, gallery_sizes)
+        results += bench_recognize_face(rng, tmp_dir, gallery_sizes)
+        results += bench_template_matching(rng, gallery_sizes)
+        results += bench_data_generator(rng, tmp_dir)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'repeats': args.repeats,
+            'seed': args.seed
+        },
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    for result in results:
+        print('{:<36} {:<45} {:>10.3f} ms'.format(result['name'], json.dumps(result['params']), result['median_ms']))
+
+
+def measure(name, params, function, repeats=None):
+    repeats = repeats or args.repeats
+    # the first call is not timed, it warms caches and lazy initialization
+    function()
+    times = list()
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    times = np.array(times)
+    return {
+        'name': name,
+        'params': params,
+        'repeats': repeats,
+        'mean_ms': float(times.mean()),
+        'median_ms': float(np.median(times)),
+        'min_ms': float(times.min()),
+        'p95_ms': float(np.percentile(times, 95))
+    }
+
+
+def synthetic_frame(rng, width, height):
+    # smooth gradient with noise, so the cascade does real work instead of rejecting a flat image immediately
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    noise = rng.normal(0, 40, (height, width, 3))
+    return np.clip(gradient + noise, 0, 255).astype(np.uint8)
+
+
+def synthetic_face(rng, x=0, y=0, size=120):
+    img = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    return Face(img, (x, y, size, size))
+
+
+def bench_detection(rng, resolutions):
+    detector = FaceDetector()
+    results = list()
+    for width, height in resolutions:
+        frame = synthetic_frame(rng, width, height)
+        results.append(measure('FaceDetector.detect_faces', {'resolution': '{}x{}'.format(width, height)},
+                               lambda: detector.detect_faces(frame)))
+    return results
+
+
+def bench_compare_faces(rng):
+    detector = FaceDetector()
+    results = list()
+    for size in (64, 128, 256):
+        face_a, face_b = synthetic_face(rng, size=size), synthetic_face(rng, size=size)
+        # fresh faces every call, otherwise only the cached descriptors would be compared
+        results.append(measure('FaceDetector.compare_faces', {'face_size': size},
+                               lambda: detector.compare_faces(Face(face_a.img, face_a.coordinates),
+                                                              Face(face_b.img, face_b.coordinates))))
+    return results
+
+
+def bench_face_correlation(rng, tmp_dir, face_counts):
+    results = list()
+    # the controller looks up the identity database, an empty temporary one keeps the shipped database untouched
+    path = os.path.join(tmp_dir, 'correlation.db')
+    initialize_schema(path)
+    DBHandler._instance = DBHandler._cls(db_path=path, use_snapshot=False)
+    for tracking in ('iou', 'ssim'):
+        controller = FrameController(num_workers=0, max_queue_size=0, tracking=tracking)
+        for count in face_counts:
+            positions = [(150 * (i % 10), 150 * (i // 10)) for i in range(count)]
+            previous = [synthetic_face(rng, x, y) for x, y in positions]
+            current = [Face(face.img, (face.coordinates[0] + 5, face.coordinates[1] + 3, 120, 120))
+                       for face in previous]
+
+            def correlate():
+                controller.clear_face_list()
+                controller.face_correlation([Face(f.img, f.coordinates) for f in previous])
+                controller.face_correlation([Face(f.img, f.coordinates) for f in current])
+                while not controller.request_queue.empty():
+                    controller.request_queue.get_nowait()
+            results.append(measure('FrameController.face_correlation', {'tracking': tracking, 'faces': count},
+                                   correlate))
+        controller.stop()
+    DBHandler._instance.close()
+    del DBHandler._instance
+    return results
+
+
+def create_database(rng, path, size):
+    handler = DBHandler._cls(db_path=path, use_index=False, use_snapshot=False)
+    rows = [('name{}'.format(i), 'surname{}'.format(i)) + handler.encode_features(rng.standard_normal(args.dim))
+            for i in range(size)]
+    with handler.connection:
+        handler.connection.executemany('INSERT INTO identities (name, surname, feature_vector, feature_dim, '
+                                       'feature_version) VALUES (?,?,?,?,?)', rows)
+        handler.connection.execute('INSERT INTO templates (identity_id, feature_vector, feature_dim) '
+                                   'SELECT identity_id, feature_vector, feature_dim FROM identities')
+    handler.close()
+
+
+def initialize_schema(path):
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE identities (identity_id integer not null constraint identities_pk primary key '
+                       'autoincrement, name text not null, surname text not null, feature_vector text not null)')
+    connection.commit()
+    connection.close()
+
+
+def bench_load_identities(rng, tmp_dir, gallery_sizes):
+    results = list()
+    for size in gallery_sizes:
+        path = os.path.join(tmp_dir, 'load-{}.db'.format(size))
+        initialize_schema(path)
+        create_database(rng, path, size)
+        for use_snapshot in (False, True):
+            handler = DBHandler._cls(db_path=path, use_index=False, use_snapshot=use_snapshot)
+            handler.save_snapshot()
+            results.append(measure('DBHandler.load_identities', {'gallery_size': size, 'snapshot': use_snapshot},
+                                   handler.load_identities, repeats=max(args.repeats // 4, 3)))
+            handler.close()
+    return results
+
+
+def bench_recognize_face(rng, tmp_dir, gallery_sizes):
+    results = list()
+    InferenceEngine._instance = SyntheticEngine(args.dim, args.seed)
+    for size in gallery_sizes:
+        path = os.path.join(tmp_dir, 'recognize-{}.db'.format(size))
+        initialize_schema(path)
+        create_database(rng, path, size)
+        DBHandler._instance = DBHandler._cls(db_path=path, use_snapshot=False)
+        recognizer = FaceRecognizer()
+        face = synthetic_face(rng)
+        feature_vector = rng.standard_normal(args.dim).astype(np.float32)
+        results.append(measure('FaceRecognizer.recognize_face', {'gallery_size': size},
+                               lambda: recognizer.recognize_face(face)))
+        results.append(measure('FaceRecognizer.match_features', {'gallery_size': size},
+                               lambda: recognizer.match_features(feature_vector)))
+        DBHandler._instance.close()
+        del DBHandler._instance
+    del InferenceEngine._instance
+    return results
+
+
+def bench_template_matching(rng, gallery_sizes, templates_per_identity=5):
+    results = list()
+    for size in gallery_sizes:
+        num_templates = size * templates_per_identity
+        owners = np.repeat(np.arange(size), templates_per_identity)
+        vectors = rng.standard_normal((num_templates, args.dim)).astype(np.float32)
+        feature_vector = rng.standard_normal(args.dim).astype(np.float32)
+        for aggregation in AGGREGATIONS:
+            gallery = Gallery.from_templates(np.arange(num_templates), owners, vectors, aggregation=aggregation)
+            gallery.match(feature_vector)
+            results.append(measure('Gallery.match', {'gallery_size': size, 'templates': num_templates,
+                                                     'aggregation': aggregation},
+                                   lambda: gallery.match(feature_vector)))
+    return results
+
+
+def bench_data_generator(rng, tmp_dir, num_classes=20, images_per_class=16):
+    path = os.path.join(tmp_dir, 'dataset.zip')
+    with zipfile.ZipFile(path, 'w') as zf:
+        for c in range(num_classes):
+            for i in range(images_per_class):
+                buffer = io.BytesIO()
+                Image.fromarray(rng.integers(0, 256, (144, 144, 3), dtype=np.uint8)).save(buffer, format='JPEG')
+                zf.writestr('class{}/{}.jpg'.format(c, i), buffer.getvalue())
+
+    results = list()
+    for use_manifest in (False, True):
+        results.append(measure('DataHolder.__init__', {'files': num_classes * images_per_class,
+                                                       'manifest': use_manifest},
+                               lambda: DataHolder([path], use_manifest=use_manifest)))
+    holder = DataHolder([path])
+    for batch_size in (32, 128):
+        generator = DataGenerator(subset='training', data_holder=holder, batch_size=batch_size)
+        results.append(measure('DataGenerator.__getitem__', {'batch_size': batch_size},
+                               lambda: generator.__getitem__(0), repeats=max(args.repeats // 4, 3)))
+
+    packed_dir = os.path.join(tmp_dir, 'packed')
+    pack_dataset(holder, packed_dir)
+    for batch_size in (32, 128):
+        generator = PackedDataGenerator(subset='training', packed_dir=packed_dir, batch_size=batch_size)
+        results.append(measure('PackedDataGenerator.__getitem__', {'batch_size': batch_size},
+                               lambda: generator.__getitem__(0)))
+
+    # a whole epoch is timed, the prefetcher only pays off once batches are consumed in order
+    generator = DataGenerator(subset='training', data_holder=holder, batch_size=32)
+    results.append(measure('DataGenerator epoch', {'batch_size': 32}, lambda: iterate_epoch(generator), repeats=3))
+    prefetcher = PrefetchingGenerator(generator, num_workers=2)
+    results.append(measure('PrefetchingGenerator epoch', {'batch_size': 32, 'workers': 2},
+                           lambda: iterate_epoch(prefetcher), repeats=3))
+    prefetcher.close()
+    return results
+
+
+def iterate_epoch(generator):
+    for i in range(len(generator)):
+        generator[i]
+    generator.on_epoch_end()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+import argparse
+import time
+import numpy as np
+
+from cnn import cnn_model as cm
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--model_path', default='resources/model_v2.h5', type=str, help='path to trained model')
+parser.add_argument('--batch_sizes', default='1,2,4,8,16', type=str, help='comma separated list of batch sizes to time')
+parser.add_argument('--repeats', default=50, type=int, help='number of timed calls per batch size')
+
+
+def main():
+    global args
+    args = parser.parse_args()
+
+    batch_sizes = [int(x) for x in args.batch_sizes.split(',')]
+    paths = {
+        'predict': cm.get_model(model_path=args.model_path, compiled=False),
+        'compiled': cm.get_model(model_path=args.model_path, compiled=True)
+    }
+
+    print('{:>10} {:>10} {:>16}'.format('path', 'batch', 'ms per face'))
+    for batch_size in batch_sizes:
+        batch = np.random.rand(batch_size, 128, 128, 1).astype(np.float32)
+        for name, model in paths.items():
+            latency = time_path(model, batch, args.repeats)
+            print('{:>10} {:>10} {:>16.3f}'.format(name, batch_size, latency * 1000 / batch_size))
+
+
+def time_path(model, batch, repeats):
+    # first call is not timed, it may still trace or allocate
+    model.get_feature_vectors(batch)
+    start = time.perf_counter()
+    for i in range(repeats):
+        model.get_feature_vectors(batch)
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    main()
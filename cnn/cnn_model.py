@@ -1,3 +1,4 @@
+import numpy as np
 import tensorflow as tf
 import keras
 from keras.models import Model
@@ -20,7 +21,7 @@ def get_model(**kwargs):
     }
 
     if 'model_path' in kwargs:
-        return TrainedModel(kwargs['model_path'])
+        return TrainedModel(kwargs['model_path'], compiled=kwargs.get('compiled', True))
     else:
         return TrainableModel(weights_path=kwargs.get('weights_path', defaults['weights_path']),
                               input_shape=kwargs.get('input_shape', defaults['input_shape']),
@@ -31,15 +32,44 @@ def get_model(**kwargs):
 
 
 class TrainedModel:
-    def __init__(self, model_path):
+    def __init__(self, model_path, compiled=True, batch_sizes=(1, 2, 4, 8, 16, 32)):
         self.model = load_model(model_path, custom_objects={'tf': tf})
-        # alternative way to obtain model output
-        # self.predictor = K.function(self.model.input, self.model.output)
+        self.functions = dict()
+        if compiled:
+            self.compile_functions(batch_sizes)
+
+    def compile_functions(self, batch_sizes):
+        # one traced graph per fixed batch size avoids both the predict() loop setup and retracing
+        input_shape = tuple(self.model.input_shape[1:])
+        forward = tf.function(lambda x: self.model(x, training=False))
+        for batch_size in sorted(batch_sizes):
+            spec = tf.TensorSpec(shape=(batch_size,) + input_shape, dtype=tf.float32)
+            self.functions[batch_size] = forward.get_concrete_function(spec)
+        # warm up every graph at load time, so the first recognized faces do not pay for it
+        for batch_size, function in self.functions.items():
+            function(tf.zeros((batch_size,) + input_shape, dtype=tf.float32))
 
     def get_feature_vector(self, face):
-        return self.model.predict(face)[0]
-        # alternative way to obtain model output
-        # return self.predictor(face)[0]
+        return self.get_feature_vectors(face)[0]
+
+    def get_feature_vectors(self, batch):
+        if len(batch) == 0:
+            return np.empty((0, self.model.output_shape[-1]), dtype=np.float32)
+        if not self.functions:
+            return self.model.predict(batch, batch_size=len(batch))
+        batch = np.asarray(batch, dtype=np.float32)
+        max_size = max(self.functions)
+        outputs = [self.run_compiled(batch[i:i + max_size]) for i in range(0, len(batch), max_size)]
+        return outputs[0] if len(outputs) == 1 else np.concatenate(outputs)
+
+    def run_compiled(self, batch):
+        size = len(batch)
+        batch_size = min(b for b in self.functions if b >= size)
+        if batch_size > size:
+            padding = np.zeros((batch_size - size,) + batch.shape[1:], dtype=np.float32)
+            batch = np.concatenate([batch, padding])
+        output = self.functions[batch_size](tf.constant(batch))
+        return output.numpy()[:size].astype(np.float32, copy=False)
 
 
 class TrainableModel:
@@ -56,12 +86,13 @@ class TrainableModel:
                            optimizer=keras.optimizers.SGD(lr=actual_lr, momentum=momentum),
                            metrics=['accuracy'])
 
-    def train_model(self, train_gen, val_gen, epochs, callbacks, init_epoch):
+    def train_model(self, train_gen, val_gen, epochs, callbacks, init_epoch, workers=4, shuffle=True):
         history = self.model.fit_generator(generator=train_gen,
                                            validation_data=val_gen,
                                            epochs=epochs,
                                            verbose=1,
-                                           workers=4,
+                                           workers=workers,
+                                           shuffle=shuffle,
                                            callbacks=callbacks,
                                            initial_epoch=init_epoch)
         return history
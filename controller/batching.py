@@ -0,0 +1,18 @@
+import time
+from queue import Empty
+
+
+def collect_batch(queue, first_item, max_batch_size, max_batch_wait):
+    # drain items that are already pending or arrive within max_batch_wait, so they share one forward pass
+    batch = [first_item]
+    deadline = time.monotonic() + max_batch_wait
+    while len(batch) < max_batch_size:
+        remaining = deadline - time.monotonic()
+        try:
+            item = queue.get(timeout=remaining) if remaining > 0 else queue.get_nowait()
+        except Empty:
+            break
+        if item is None:
+            return batch, False
+        batch.append(item)
+    return batch, True
@@ -0,0 +1,135 @@
+import os
+import csv
+import zipfile
+import threading
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from controller.face_detector import FaceDetector
+from model.identity_model import Identity
+
+IMG_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+class EnrollmentReport:
+    def __init__(self):
+        self.num_files = 0
+        self.identities = list()
+        self.failures = list()
+
+    def add_failure(self, file_name, reason):
+        self.failures.append((file_name, reason))
+
+
+class BulkEnroller:
+    def __init__(self, face_rec, db_handler, num_workers=4, batch_size=32):
+        self.face_rec = face_rec
+        self.db_handler = db_handler
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.local = threading.local()
+
+    def enroll(self, source):
+        report = EnrollmentReport()
+        archive = zipfile.ZipFile(source) if zipfile.is_zipfile(source) else None
+        try:
+            items = self.list_items(source, archive, report)
+            report.num_files += len(items)
+            features = self.embed_items(items, report, archive)
+        finally:
+            if archive is not None:
+                archive.close()
+
+        # every enrolled image becomes one template of its person
+        for (name, surname), vectors in features.items():
+            report.identities.append(Identity(name=name, surname=surname, templates=np.stack(vectors)))
+        self.db_handler.add_identities(report.identities)
+        return report
+
+    def list_items(self, source, archive, report):
+        if archive is not None:
+            names = [name for name in archive.namelist() if name.lower().endswith(IMG_EXTENSIONS)]
+            return self.parse_layout([(name, os.path.basename(os.path.dirname(name))) for name in names], report)
+        if os.path.isdir(source):
+            files = list()
+            for person_dir in sorted(os.listdir(source)):
+                dir_path = os.path.join(source, person_dir)
+                if not os.path.isdir(dir_path):
+                    continue
+                files.extend((os.path.join(dir_path, file_name), person_dir) for file_name in sorted(os.listdir(dir_path))
+                             if file_name.lower().endswith(IMG_EXTENSIONS))
+            return self.parse_layout(files, report)
+        if source.lower().endswith('.csv'):
+            return self.read_manifest(source, report)
+        raise ValueError('Please specify directory, zip archive or CSV manifest')
+
+    def parse_layout(self, files, report):
+        items = list()
+        for file_name, person_dir in files:
+            name, _, surname = person_dir.partition('_')
+            if not name or not surname:
+                report.num_files += 1
+                report.add_failure(file_name, 'Directory name does not match name_surname layout')
+                continue
+            items.append((file_name, name, surname.replace('_', ' ')))
+        return items
+
+    def read_manifest(self, source, report):
+        # manifest rows are name, surname, path, relative paths are resolved against the manifest directory
+        base_dir = os.path.dirname(os.path.abspath(source))
+        items = list()
+        with open(source, newline='') as f:
+            for row in csv.DictReader(f):
+                name, surname, path = row.get('name'), row.get('surname'), row.get('path')
+                if not name or not surname or not path:
+                    report.num_files += 1
+                    report.add_failure(path or '', 'Manifest row is missing name, surname or path')
+                    continue
+                items.append((os.path.join(base_dir, path), name, surname))
+        return items
+
+    def embed_items(self, items, report, archive=None):
+        features = dict()
+        chunks = [items[start:start + self.batch_size] for start in range(0, len(items), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            # the next chunk is decoded and aligned while the current one is being embedded
+            pending = [executor.submit(self.prepare_item, item, archive) for item in chunks[0]] if chunks else []
+            for i, chunk in enumerate(chunks):
+                prepared = [future.result() for future in pending]
+                if i + 1 < len(chunks):
+                    pending = [executor.submit(self.prepare_item, item, archive) for item in chunks[i + 1]]
+                batch, owners = list(), list()
+                for (file_name, name, surname), (normalized, error) in zip(chunk, prepared):
+                    if error is not None:
+                        report.add_failure(file_name, error)
+                        continue
+                    batch.append(normalized)
+                    owners.append((name, surname))
+                if batch:
+                    self.embed_batch(batch, owners, features)
+        return features
+
+    def embed_batch(self, batch, owners, features):
+        for owner, feature_vector in zip(owners, self.face_rec.engine.get_feature_vectors(np.concatenate(batch))):
+            features.setdefault(owner, list()).append(np.asarray(feature_vector, dtype=np.float32))
+
+    def prepare_item(self, item, archive):
+        file_name = item[0]
+        try:
+            if archive is not None:
+                data = archive.read(file_name)
+            else:
+                with open(file_name, 'rb') as f:
+                    data = f.read()
+            img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                raise ValueError('Unable to decode image')
+            return self.face_rec.prepare_face(img, self.get_detector()), None
+        except (OSError, KeyError, ValueError, RuntimeError, cv2.error) as e:
+            return None, str(e)
+
+    def get_detector(self):
+        # cascade classifiers are not shared between threads
+        if not hasattr(self.local, 'face_det'):
+            self.local.face_det = FaceDetector()
+        return self.local.face_det
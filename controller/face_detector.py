@@ -1,25 +1,67 @@
 import cv2
+import numpy as np
 from model.face_model import Face
+from controller.face_tracker import iou_matrix
 from skimage.metrics import structural_similarity as ssim
 
 
 class FaceDetector:
-    def __init__(self):
+    def __init__(self, detection_scale=1.0, roi_scale=1.0, roi_padding=0.5, full_scan_period=1, nms_threshold=0.3):
         self.face_det = cv2.CascadeClassifier('resources/haarcascade_frontalface_default.xml')
+        self.detection_scale = detection_scale
+        self.roi_scale = roi_scale
+        self.roi_padding = roi_padding
+        self.full_scan_period = full_scan_period
+        self.nms_threshold = nms_threshold
+        self.scan_counter = 0
 
-    def detect_faces(self, img):
+    def detect_faces(self, img, tracked_faces=None):
         grayscale = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        dets = self.face_det.detectMultiScale(grayscale, minNeighbors=8)
+        tracked_faces = list(tracked_faces) if tracked_faces is not None else []
+        # periodic full scans pick up new arrivals, in between only regions around tracked faces are searched
+        if not tracked_faces or self.scan_counter % self.full_scan_period == 0:
+            boxes = self.detect_boxes(grayscale, self.detection_scale)
+            self.scan_counter = 0
+        else:
+            boxes = self.detect_regions(grayscale, [face.coordinates for face in tracked_faces])
+        self.scan_counter += 1
+
         faces = list()
-        for (x, y, w, h) in dets:
+        for (x, y, w, h) in boxes:
             face_img = img[y:y + h, x:x + w].copy()
             faces.append(Face(face_img, (x, y, w, h)))
         return faces
 
+    def detect_boxes(self, grayscale, scale, offset=(0, 0)):
+        if scale != 1.0:
+            grayscale = cv2.resize(grayscale, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        dets = self.face_det.detectMultiScale(grayscale, minNeighbors=8)
+        return [(int(x / scale) + offset[0], int(y / scale) + offset[1], int(w / scale), int(h / scale))
+                for (x, y, w, h) in dets]
+
+    def detect_regions(self, grayscale, regions):
+        img_h, img_w = grayscale.shape[:2]
+        boxes = list()
+        for (x, y, w, h) in regions:
+            pad_x, pad_y = int(w * self.roi_padding), int(h * self.roi_padding)
+            x1, y1 = max(x - pad_x, 0), max(y - pad_y, 0)
+            x2, y2 = min(x + w + pad_x, img_w), min(y + h + pad_y, img_h)
+            if x2 > x1 and y2 > y1:
+                boxes.extend(self.detect_boxes(grayscale[y1:y2, x1:x2], self.roi_scale, offset=(x1, y1)))
+        return self.suppress_duplicates(boxes)
+
+    def suppress_duplicates(self, boxes):
+        # padded regions of neighbouring faces overlap, the same face may be found more than once
+        if len(boxes) < 2:
+            return boxes
+        array = np.array(boxes, dtype=np.float32)
+        iou = iou_matrix(array, array)
+        order = np.argsort(-(array[:, 2] * array[:, 3]))
+        kept = list()
+        for i in order:
+            if all(iou[i, j] < self.nms_threshold for j in kept):
+                kept.append(i)
+        return [boxes[i] for i in kept]
+
     def compare_faces(self, face_a, face_b):
-        a_gray = cv2.cvtColor(face_a.img, cv2.COLOR_BGR2GRAY)
-        b_gray = cv2.cvtColor(face_b.img, cv2.COLOR_BGR2GRAY)
-        b_resized = cv2.resize(b_gray, a_gray.shape)
-        a_blurred = cv2.bilateralFilter(cv2.medianBlur(a_gray, 5), 5, 75, 75)
-        b_blurred = cv2.bilateralFilter(cv2.medianBlur(b_resized, 5), 5, 75, 75)
-        return ssim(a_blurred, b_blurred)
+        return ssim(face_a.get_descriptor(), face_b.get_descriptor())
@@ -1,25 +1,25 @@
 import dlib
 import cv2
 import numpy as np
-from numpy import dot
-from numpy.linalg import norm
-from cnn import cnn_model as cm
 from model.db_handler import DBHandler
 from controller.face_detector import FaceDetector
+from controller.inference_engine import InferenceEngine
+from controller.metrics import Metrics
 
 
 class FaceRecognizer:
-    def __init__(self, cs_threshold=0.31):
+    def __init__(self, cs_threshold=0.31, metrics=None, memory=None):
         self.cs_threshold = cs_threshold
-        self.model = cm.get_model(model_path='resources/model_v2.h5')
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.memory = memory
+        self.engine = InferenceEngine.get_instance()
         self.face_det = FaceDetector()
-        self.shape_pred = dlib.shape_predictor('resources/shape_predictor_5_face_landmarks.dat')
         self.handler = DBHandler.get_instance()
 
     def align_face(self, face):
         x, y, z = face.img.shape
         rect = dlib.rectangle(0, 0, x, y)
-        landmarks = self.shape_pred(face.img, rect)
+        landmarks = self.engine.get_landmarks(face.img, rect)
         return dlib.get_face_chip(face.img, landmarks, 128)
 
     def normalize_face(self, face):
@@ -30,28 +30,41 @@ class FaceRecognizer:
         return normalized
 
     def recognize_face(self, face):
-        aligned = self.align_face(face)
-        normalized = self.normalize_face(aligned)
+        return self.recognize_faces([face])[0][0]
 
-        feature_vector = self.model.get_feature_vector(normalized)
-        person, max_similarity = None, -1
-        for identity in self.handler.get_identities().values():
-            # Cosine similarity
-            similarity = dot(identity.features, feature_vector) / (norm(identity.features) * norm(feature_vector))
-            print('Similarity with {} {} -> {}'.format(identity.name, identity.surname, similarity))
-            if similarity > self.cs_threshold and similarity > max_similarity:
-                person = identity
-                max_similarity = similarity
+    def recognize_faces(self, faces):
+        with self.metrics.timer('alignment'):
+            batch = np.concatenate([self.normalize_face(self.align_face(face)) for face in faces])
+        with self.metrics.timer('inference'):
+            feature_vectors = self.engine.get_feature_vectors(batch)
+        for face, feature_vector in zip(faces, feature_vectors):
+            face.embedding = feature_vector
+        with self.metrics.timer('matching'):
+            return [self.match_features(feature_vector) for feature_vector in feature_vectors]
 
-        return person
+    def match_features(self, feature_vector):
+        # recently seen people are looked up in the small track memory before the whole gallery
+        if self.memory is not None:
+            identity, similarity = self.memory.match_embedding(feature_vector, self.handler.get_identities())
+            if identity is not None:
+                self.metrics.increment('memory_matches')
+                return identity, similarity
+        # Cosine similarity against pre-normalized gallery rows
+        identity_id, similarity = self.handler.get_gallery().match(feature_vector)
+        if identity_id is None or similarity <= self.cs_threshold:
+            return None, similarity
+        return self.handler.get_identities().get(identity_id), similarity
 
     def get_facial_features(self, img):
-        faces = self.face_det.detect_faces(img)
+        return self.engine.get_feature_vectors(self.prepare_face(img))[0]
+
+    def prepare_face(self, img, face_det=None):
+        # face_det allows callers running on several threads to use their own cascade classifier
+        faces = (face_det or self.face_det).detect_faces(img)
         if len(faces) > 1:
             raise ValueError('Multiple faces detected! Please provide image containing only one face')
         elif len(faces) == 0:
             raise ValueError('No faces detected! Please provide image containing at least one face')
 
         aligned = self.align_face(faces[0])
-        normalized = self.normalize_face(aligned)
-        return self.model.get_feature_vector(normalized)
+        return self.normalize_face(aligned)
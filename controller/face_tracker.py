@@ -0,0 +1,96 @@
+import numpy as np
+
+
+class FaceTracker:
+    def __init__(self, iou_threshold=0.3, ambiguity_margin=0.1, max_center_distance=0.5, use_motion=True,
+                 smoothing=0.5):
+        self.iou_threshold = iou_threshold
+        self.ambiguity_margin = ambiguity_margin
+        self.max_center_distance = max_center_distance
+        self.use_motion = use_motion
+        self.smoothing = smoothing
+        self.motion = dict()
+
+    def reset(self):
+        self.motion.clear()
+
+    def associate(self, new_faces, present_faces, compare_faces, sim_threshold):
+        matches = [None] * len(new_faces)
+        tracks = list(present_faces.values())
+        if not new_faces or not tracks:
+            return matches
+
+        detections = np.array([face.coordinates for face in new_faces], dtype=np.float32)
+        predicted = np.array([self.predict(face) for face in tracks], dtype=np.float32)
+        iou = iou_matrix(detections, predicted)
+        used = set()
+
+        # greedy assignment in order of decreasing overlap
+        for flat in np.argsort(-iou, axis=None):
+            i, j = divmod(int(flat), len(tracks))
+            if iou[i, j] < self.iou_threshold:
+                break
+            if matches[i] is not None or j in used:
+                continue
+            rivals = [k for k in range(len(tracks)) if k != j and k not in used
+                      and iou[i, k] >= max(iou[i, j] - self.ambiguity_margin, self.iou_threshold)]
+            if rivals:
+                # overlapping tracks are resolved by appearance only when geometry cannot tell them apart
+                candidates = [j] + rivals
+                similarities = [compare_faces(new_faces[i], tracks[k]) for k in candidates]
+                j = candidates[int(np.argmax(similarities))]
+            matches[i] = tracks[j]
+            used.add(j)
+
+        # detections without overlap may still belong to a nearby track that moved faster than predicted
+        for i, face in enumerate(new_faces):
+            if matches[i] is not None:
+                continue
+            candidates = [j for j in range(len(tracks))
+                          if j not in used and self.center_distance(detections[i], predicted[j]) < self.max_center_distance]
+            if not candidates:
+                continue
+            similarities = [compare_faces(face, tracks[j]) for j in candidates]
+            best = int(np.argmax(similarities))
+            if similarities[best] >= sim_threshold:
+                matches[i] = tracks[candidates[best]]
+                used.add(candidates[best])
+        return matches
+
+    def update(self, present_faces):
+        motion = dict()
+        for face_id, face in present_faces.items():
+            (x, y, w, h) = face.coordinates
+            center = np.array([x + w / 2, y + h / 2], dtype=np.float32)
+            velocity = np.zeros(2, dtype=np.float32)
+            if face_id in self.motion:
+                prev_center, prev_velocity = self.motion[face_id]
+                velocity = self.smoothing * prev_velocity + (1 - self.smoothing) * (center - prev_center)
+            motion[face_id] = (center, velocity)
+        self.motion = motion
+
+    def predict(self, face):
+        (x, y, w, h) = face.coordinates
+        if not self.use_motion or face.face_id not in self.motion:
+            return x, y, w, h
+        # constant velocity model, one step equals one detection cycle
+        center, velocity = self.motion[face.face_id]
+        cx, cy = center + velocity
+        return cx - w / 2, cy - h / 2, w, h
+
+    def center_distance(self, box_a, box_b):
+        center_a = box_a[:2] + box_a[2:] / 2
+        center_b = box_b[:2] + box_b[2:] / 2
+        return np.linalg.norm(center_a - center_b) / max(box_b[2], box_b[3], 1)
+
+
+def iou_matrix(boxes_a, boxes_b):
+    a_x2, a_y2 = boxes_a[:, 0] + boxes_a[:, 2], boxes_a[:, 1] + boxes_a[:, 3]
+    b_x2, b_y2 = boxes_b[:, 0] + boxes_b[:, 2], boxes_b[:, 1] + boxes_b[:, 3]
+    inter_w = np.minimum(a_x2[:, None], b_x2[None]) - np.maximum(boxes_a[:, 0, None], boxes_b[None, :, 0])
+    inter_h = np.minimum(a_y2[:, None], b_y2[None]) - np.maximum(boxes_a[:, 1, None], boxes_b[None, :, 1])
+    intersection = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    area_a = boxes_a[:, 2] * boxes_a[:, 3]
+    area_b = boxes_b[:, 2] * boxes_b[:, 3]
+    union = area_a[:, None] + area_b[None] - intersection
+    return intersection / np.maximum(union, 1e-6)
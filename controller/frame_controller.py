@@ -1,89 +1,301 @@
 import cv2
+import time
+import numpy as np
 import uuid
+from threading import Thread, RLock, Event
 from model import face_model as fm
 from controller.face_detector import FaceDetector
+from controller.face_tracker import FaceTracker
 from controller.worker import Worker
+from controller.process_worker import ProcessPool
+from controller.metrics import Metrics, MetricsReporter
+from controller.request_queue import RecognitionQueue
+from controller.track_memory import TrackMemory
+from model.db_handler import DBHandler
 from queue import Queue, Empty
 
 
 class FrameController:
-    def __init__(self, sim_threshold=0.54, num_workers=2, max_queue_size=10, frame_proc_freq=3):
+    def __init__(self, sim_threshold=0.54, num_workers=2, max_queue_size=10, frame_proc_freq=3, max_batch_size=8,
+                 max_batch_wait=0.005, execution_mode='thread', tracking='iou', detection_scale=1.0, roi_scale=1.0,
+                 full_scan_period=1, metrics_log_interval=None, metrics_port=None, overflow_policy='drop_oldest',
+                 track_memory=True, aggregation='max', index_probes=8):
+        if execution_mode not in ['thread', 'process']:
+            raise ValueError('Invalid execution mode: {}'.format(execution_mode))
+        if tracking not in ['iou', 'ssim']:
+            raise ValueError('Invalid tracking mode: {}'.format(tracking))
+
+        self.metrics = Metrics()
+        self.metrics.increment('dropped_requests', 0)
         self.frame_counter = 0
         self.frame_proc_freq = frame_proc_freq
         self.sim_threshold = sim_threshold
         self.present_faces = dict()
-        self.face_det = FaceDetector()
-        self.request_queue = Queue(maxsize=max_queue_size)
+        self.overlay_version = 0
+        self.render_buffer = None
+        # guards present faces and pending requests when detection runs on its own thread
+        self.lock = RLock()
+        self.detection_thread = None
+        self.detection_stopped = Event()
+        self.face_det = FaceDetector(detection_scale=detection_scale, roi_scale=roi_scale,
+                                     full_scan_period=full_scan_period)
+        self.tracker = FaceTracker() if tracking == 'iou' else None
+        self.memory = TrackMemory() if track_memory else None
+        # the handler is created here, before any recognizer, so that the matching settings apply to all of them
+        self.handler = DBHandler.get_instance(aggregation=aggregation, index_probes=index_probes)
+        self.request_queue = RecognitionQueue(maxsize=max_queue_size, policy=overflow_policy)
+        self.pending_ids = set()
         self.response_queue = Queue(maxsize=max_queue_size)
         self.workers = list()
-        for i in range(num_workers):
-            worker = Worker(self.request_queue, self.response_queue)
-            worker.start()
-            self.workers.append(worker)
+        self.process_pool = None
+        if execution_mode == 'process':
+            self.process_pool = ProcessPool(self.request_queue, self.response_queue, num_workers, max_batch_size,
+                                            max_batch_wait, metrics=self.metrics)
+        else:
+            for i in range(num_workers):
+                worker = Worker(self.request_queue, self.response_queue, max_batch_size, max_batch_wait,
+                                metrics=self.metrics, memory=self.memory)
+                worker.start()
+                self.workers.append(worker)
+        self.reporter = None
+        if metrics_log_interval or metrics_port is not None:
+            self.reporter = MetricsReporter(self.metrics, self.get_stats, metrics_log_interval, metrics_port)
 
     def stop(self):
+        if self.detection_thread is not None:
+            self.detection_stopped.set()
+            self.detection_thread.join()
+        if self.reporter is not None:
+            self.reporter.stop()
+        if self.process_pool is not None:
+            self.process_pool.stop()
         for i in range(len(self.workers)):
             self.request_queue.put(None)
         for worker in self.workers:
             worker.join()
 
     def clear_face_list(self):
-        self.present_faces.clear()
+        with self.lock:
+            self.present_faces = dict()
+            self.pending_ids.clear()
+            self.overlay_version += 1
+            if self.tracker is not None:
+                self.tracker.reset()
+            if self.memory is not None:
+                self.memory.clear()
+
+    def get_stats(self):
+        self.update_gauges()
+        return self.metrics.snapshot()
+
+    def update_gauges(self):
+        self.metrics.set_gauge('request_queue_depth', self.request_queue.qsize())
+        self.metrics.set_gauge('response_queue_depth', self.response_queue.qsize())
+        self.metrics.set_gauge('present_faces', len(self.present_faces))
+
+    def start_detection(self, grabber):
+        # detection follows the grabber at its own pace, process_frame then only collects results and renders
+        self.detection_thread = Thread(target=self.detection_loop, args=(grabber,), daemon=True)
+        self.detection_thread.start()
+
+    def detection_loop(self, grabber):
+        # as in the synchronous path, detection runs at most on every frame_proc_freq-th captured frame
+        sequence, detected = 0, -self.frame_proc_freq
+        while not self.detection_stopped.is_set():
+            sequence, frame = grabber.wait_for_frame(sequence, timeout=0.1)
+            if frame is None or sequence - detected < self.frame_proc_freq:
+                continue
+            detected = sequence
+            self.detect(frame)
 
-    def process_frame(self, frame):
-        if self.frame_counter % self.frame_proc_freq == 0:
-            faces = self.face_det.detect_faces(frame)
+    def detect(self, frame):
+        self.metrics.increment('detection_cycles')
+        with self.metrics.timer('detection'):
+            faces = self.face_det.detect_faces(frame, list(self.present_faces.values()))
+        with self.metrics.timer('correlation'), self.lock:
             self.face_correlation(faces)
-            self.frame_counter = 0
-        self.frame_counter += 1
 
-        self.get_results()
-        self.label_faces(frame)
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    def process_frame(self, frame, render=True, draw_labels=True):
+        self.metrics.increment('frames')
+        if self.detection_thread is None:
+            if self.frame_counter % self.frame_proc_freq == 0:
+                self.detect(frame)
+                self.frame_counter = 0
+            self.frame_counter += 1
+
+        with self.metrics.timer('results'), self.lock:
+            self.get_results()
+        self.update_gauges()
+        if not render:
+            return frame
+        with self.metrics.timer('rendering'):
+            # labels are drawn on the converted copy, the source frame may still be read by detection
+            frame = self.convert_frame(frame)
+            if draw_labels:
+                self.label_faces(frame)
         return frame
 
+    def convert_frame(self, frame):
+        # the returned RGBA buffer is reused and overwritten by the next call
+        height, width = frame.shape[:2]
+        if self.render_buffer is None or self.render_buffer.shape[:2] != (height, width):
+            self.render_buffer = np.empty((height, width, 4), dtype=np.uint8)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA, dst=self.render_buffer)
+        return self.render_buffer
+
     def face_correlation(self, new_faces):
+        if self.tracker is not None:
+            joint_faces = self.tracker.associate(new_faces, self.present_faces, self.face_det.compare_faces,
+                                                 self.sim_threshold)
+        else:
+            joint_faces = [self.find_joint_face(new_face) for new_face in new_faces]
+
         new_faces_dict = dict()
-        for new_face in new_faces:
-            max_similarity, joint_index = 0, ''
-            for key, present_face in self.present_faces.items():
-                similarity = self.face_det.compare_faces(new_face, present_face)
-                if similarity > max_similarity:
-                    max_similarity = similarity
-                    joint_index = key
-            if max_similarity < self.sim_threshold:
+        for new_face, joint_face in zip(new_faces, joint_faces):
+            recalled = False
+            if joint_face is None:
+                joint_face = self.recall_face(new_face)
+                recalled = joint_face is not None
+            if joint_face is None:
                 new_face.face_id = uuid.uuid4().hex
-                self.request_queue.put(new_face)
+                new_face.first_seen = time.monotonic()
+                self.metrics.increment('new_tracks')
+                self.submit_face(new_face)
             else:
-                joint_face = self.present_faces[joint_index]
                 new_face.face_id = joint_face.face_id
+                new_face.first_seen = joint_face.first_seen
+                new_face.enqueued_at = joint_face.enqueued_at
                 new_face.identity = joint_face.identity
                 new_face.state = joint_face.state
+                new_face.similarity = joint_face.similarity
+                new_face.embedding = joint_face.embedding
+                new_face.votes_needed = joint_face.votes_needed
+                # the recall itself matched the remembered crop, votes are collected on the following cycles
+                if new_face.votes_needed > 0 and not recalled:
+                    self.confirm_recalled_face(new_face)
+                # tracks whose request was dropped earlier are retried with the fresh crop
+                if new_face.state == fm.PROCESSING and new_face.votes_needed == 0:
+                    if new_face.face_id not in self.pending_ids:
+                        self.metrics.increment('requeued_requests')
+                        self.submit_face(new_face)
+                    elif self.request_queue.policy == 'coalesce':
+                        self.request_queue.replace(new_face)
             new_faces_dict[new_face.face_id] = new_face
+
+        if self.memory is not None:
+            for face_id, face in self.present_faces.items():
+                if face_id not in new_faces_dict:
+                    self.memory.release(face)
         self.present_faces = new_faces_dict
+        self.overlay_version += 1
+        if self.tracker is not None:
+            self.tracker.update(self.present_faces)
+
+    def recall_face(self, new_face):
+        if self.memory is None:
+            return None
+        entry = self.memory.recall(new_face, self.face_det.compare_faces, self.sim_threshold)
+        if entry is None:
+            return None
+        identity = entry.identity
+        if identity is not None:
+            identity = self.handler.get_identities().get(identity.identity_id)
+            if identity is None:
+                # the remembered identity was deleted in the meantime
+                self.memory.forget(entry.face_id)
+                return None
+        self.metrics.increment('memory_recalls')
+        recalled = entry.face
+        recalled.identity = identity
+        recalled.similarity = entry.similarity
+        recalled.votes_needed = self.memory.confirm_votes
+        # the track stays in processing state until the recalled identity is confirmed
+        recalled.state = fm.PROCESSING if recalled.votes_needed > 0 else self.recalled_state(recalled)
+        return recalled
+
+    def confirm_recalled_face(self, face):
+        if self.memory.confirm(face, self.face_det.compare_faces, self.sim_threshold):
+            if face.votes_needed == 0:
+                face.state = self.recalled_state(face)
+            return
+        # the recalled identity was not confirmed, the track goes through full recognition after all
+        self.metrics.increment('memory_rejections')
+        face.identity, face.similarity, face.embedding = None, None, None
+        face.state = fm.PROCESSING
+        face.votes_needed = 0
+        face.first_seen = time.monotonic()
+
+    def recalled_state(self, face):
+        return fm.RECOGNIZED if face.identity is not None else fm.UNKNOWN
+
+    def submit_face(self, face):
+        face.enqueued_at = time.monotonic()
+        self.pending_ids.add(face.face_id)
+        for dropped in self.request_queue.put(face):
+            self.metrics.increment('dropped_requests')
+            # a coalesced request is replaced by the new one of the same track, which stays pending
+            if dropped is face or dropped.face_id != face.face_id:
+                self.pending_ids.discard(dropped.face_id)
+
+    def find_joint_face(self, new_face):
+        max_similarity, joint_face = 0, None
+        for present_face in self.present_faces.values():
+            similarity = self.face_det.compare_faces(new_face, present_face)
+            if similarity > max_similarity:
+                max_similarity = similarity
+                joint_face = present_face
+        return joint_face if max_similarity >= self.sim_threshold else None
+
+    def get_overlays(self):
+        with self.lock:
+            return [(face.coordinates,) + self.describe_face(face) for face in self.present_faces.values()]
+
+    def describe_face(self, face):
+        # colors are in RGB order
+        if face.state == fm.UNKNOWN:
+            return (255, 0, 0), 'Unknown person'
+        elif face.state == fm.RECOGNIZED:
+            return (0, 255, 0), '{} {}'.format(face.identity.name, face.identity.surname)
+        return (0, 0, 255), 'Processing...'
 
     def label_faces(self, frame):
-        for face in self.present_faces.values():
-            (x, y, w, h) = face.coordinates
-            if face.state == fm.UNKNOWN:
-                color = (0, 0, 255)
-                label = 'Unknown person'
-            elif face.state == fm.RECOGNIZED:
-                color = (0, 255, 0)
-                label = '{} {}'.format(face.identity.name, face.identity.surname)
-            else:
-                color = (255, 0, 0)
-                label = 'Processing...'
+        for (x, y, w, h), color, label in self.get_overlays():
+            color = color + (255,)
             cv2.rectangle(frame, (x, y), (x + w, y + h), color, 1)
             cv2.putText(frame, label, (x, y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.75, color, 1)
 
+    def wait_for_results(self, timeout=None):
+        # collects recognitions that are still in flight, e.g. once the input of headless processing has ended
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                self.get_results()
+                if not self.pending_ids:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+
     def get_results(self):
         while True:
             try:
                 face = self.response_queue.get_nowait()
+                self.pending_ids.discard(face.face_id)
+                if face.similarity is None:
+                    # the request failed, the track is still processing and is queued again on the next detection
+                    continue
+                self.metrics.increment('recognitions')
                 if face.face_id in self.present_faces:
                     joint_face = self.present_faces[face.face_id]
+                    if joint_face.state == fm.PROCESSING:
+                        self.metrics.record('time_to_identity', time.monotonic() - joint_face.first_seen)
                     joint_face.identity = face.identity
+                    joint_face.similarity = face.similarity
                     joint_face.state = fm.RECOGNIZED if face.identity is not None else fm.UNKNOWN
+                    joint_face.embedding = face.embedding
+                    joint_face.votes_needed = 0
+                    self.overlay_version += 1
+                    if self.memory is not None:
+                        self.memory.remember(joint_face, face.embedding)
             except Empty:
                 break
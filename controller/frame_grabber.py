@@ -0,0 +1,42 @@
+import time
+from collections import deque
+from threading import Thread, Condition, Event
+
+
+class FrameGrabber(Thread):
+    def __init__(self, camera, buffer_size=2):
+        super().__init__(daemon=True)
+        self.camera = camera
+        self.frames = deque(maxlen=buffer_size)
+        self.sequence = 0
+        self.condition = Condition()
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            check, frame = self.camera.read()
+            if not check:
+                time.sleep(0.01)
+                continue
+            # older frames fall out of the ring buffer, consumers always get the most recent one
+            with self.condition:
+                self.frames.append(frame)
+                self.sequence += 1
+                self.condition.notify_all()
+
+    def stop(self):
+        self.stopped.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self.is_alive():
+            self.join()
+        self.camera.release()
+
+    def latest(self):
+        with self.condition:
+            return self.sequence, self.frames[-1] if self.frames else None
+
+    def wait_for_frame(self, last_sequence, timeout=None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence != last_sequence or self.stopped.is_set(), timeout)
+            return self.sequence, self.frames[-1] if self.frames else None
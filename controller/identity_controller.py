@@ -1,5 +1,6 @@
 from model.db_handler import DBHandler
 from controller.face_recognizer import FaceRecognizer
+from controller.bulk_enrollment import BulkEnroller
 import cv2
 
 
@@ -8,6 +9,9 @@ class IdentityController:
         self.db_handler = DBHandler.get_instance()
         self.face_rec = FaceRecognizer()
 
+    def close(self):
+        self.db_handler.close()
+
     def get_identities(self):
         return self.db_handler.get_identities()
 
@@ -37,8 +41,20 @@ class IdentityController:
             identity.features = facial_vector
         self.db_handler.edit_identity(identity)
 
+    def add_photo(self, identity_id, img_file_path):
+        if not img_file_path or not self.valid_img_file_ext(img_file_path):
+            raise ValueError('Please specify path to valid image file')
+
+        img = cv2.imread(img_file_path)
+        facial_vector = self.face_rec.get_facial_features(img)
+        self.db_handler.add_templates(identity_id, facial_vector)
+
     def delete_identity(self, identity_id):
         self.db_handler.delete_identity(identity_id)
 
     def valid_img_file_ext(self, file_path):
         return file_path.lower().endswith(('.png', '.jpg', '.jpeg'))
+
+    def add_identities(self, source, num_workers=4, batch_size=32):
+        enroller = BulkEnroller(self.face_rec, self.db_handler, num_workers=num_workers, batch_size=batch_size)
+        return enroller.enroll(source)
@@ -0,0 +1,84 @@
+import dlib
+import numpy as np
+from concurrent.futures import Future
+from queue import Queue
+from threading import Thread, Lock
+from cnn import cnn_model as cm
+from controller.batching import collect_batch
+from model.db_handler import Singleton
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+@Singleton
+class InferenceEngine:
+    def __init__(self, model_path='resources/model_v2.h5',
+                 predictor_path='resources/shape_predictor_5_face_landmarks.dat', max_batch_size=32,
+                 max_batch_wait=0.002):
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+        self.model = cm.get_model(model_path=model_path)
+        self.shape_pred = dlib.shape_predictor(predictor_path)
+        self.landmark_lock = Lock()
+        self.requests = Queue()
+        self.num_requests = 0
+        self.num_batches = 0
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            # requests coming from different workers are merged into one forward pass
+            requests, running = collect_batch(self.requests, request, self.max_batch_size, self.max_batch_wait)
+            self.process(requests)
+            if not running:
+                break
+
+    def process(self, requests):
+        self.num_requests += len(requests)
+        self.num_batches += 1
+        try:
+            feature_vectors = self.model.get_feature_vectors(np.concatenate([batch for batch, future in requests]))
+        except Exception as e:
+            for batch, future in requests:
+                future.set_exception(e)
+            return
+        start = 0
+        for batch, future in requests:
+            future.set_result(feature_vectors[start:start + len(batch)])
+            start += len(batch)
+
+    def stop(self):
+        self.requests.put(None)
+        self.thread.join()
+
+    def submit(self, batch):
+        future = Future()
+        self.requests.put((batch, future))
+        return future
+
+    def get_feature_vectors(self, batch):
+        return self.submit(batch).result()
+
+    def get_landmarks(self, img, rect):
+        with self.landmark_lock:
+            return self.shape_pred(img, rect)
+
+    def memory_footprint(self):
+        weights = self.model.model.get_weights()
+        footprint = {
+            'model_parameters': int(sum(w.size for w in weights)),
+            'model_bytes': int(sum(w.nbytes for w in weights)),
+            'requests': self.num_requests,
+            'batches': self.num_batches
+        }
+        if resource is not None:
+            # ru_maxrss is reported in kilobytes on Linux
+            footprint['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return footprint
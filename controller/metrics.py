@@ -0,0 +1,128 @@
+import json
+import logging
+import threading
+import time
+import numpy as np
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    def __init__(self, window=512, prefix='facerecognizer'):
+        self.window = window
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.samples = dict()
+        self.totals = dict()
+        self.counters = dict()
+        self.gauges = dict()
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+                self.totals[name] = [0, 0.0]
+            self.samples[name].append(seconds)
+            self.totals[name][0] += 1
+            self.totals[name][1] += seconds
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def snapshot(self):
+        with self.lock:
+            samples = {name: np.array(values) for name, values in self.samples.items()}
+            totals = {name: tuple(total) for name, total in self.totals.items()}
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+
+        # percentiles are computed over the last `window` samples, count and sum over the whole run
+        timings = dict()
+        for name, values in samples.items():
+            timings[name] = {
+                'count': totals[name][0],
+                'sum_ms': totals[name][1] * 1000,
+                'mean_ms': float(values.mean() * 1000) if len(values) else 0.0,
+                'p50_ms': float(np.percentile(values, 50) * 1000) if len(values) else 0.0,
+                'p95_ms': float(np.percentile(values, 95) * 1000) if len(values) else 0.0,
+                'max_ms': float(values.max() * 1000) if len(values) else 0.0
+            }
+        return {'timings': timings, 'counters': counters, 'gauges': gauges}
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = ['# TYPE {}_stage_seconds summary'.format(self.prefix)]
+        for name, timing in snapshot['timings'].items():
+            for quantile, key in (('0.5', 'p50_ms'), ('0.95', 'p95_ms')):
+                lines.append('{}_stage_seconds{{stage="{}",quantile="{}"}} {}'
+                             .format(self.prefix, name, quantile, timing[key] / 1000))
+            lines.append('{}_stage_seconds_sum{{stage="{}"}} {}'.format(self.prefix, name, timing['sum_ms'] / 1000))
+            lines.append('{}_stage_seconds_count{{stage="{}"}} {}'.format(self.prefix, name, timing['count']))
+        for name, value in snapshot['counters'].items():
+            lines.append('# TYPE {}_{}_total counter'.format(self.prefix, name))
+            lines.append('{}_{}_total {}'.format(self.prefix, name, value))
+        for name, value in snapshot['gauges'].items():
+            lines.append('# TYPE {}_{} gauge'.format(self.prefix, name))
+            lines.append('{}_{} {}'.format(self.prefix, name, value))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsReporter:
+    def __init__(self, metrics, snapshot_function=None, log_interval=None, port=None, host='127.0.0.1'):
+        self.metrics = metrics
+        self.snapshot_function = snapshot_function or metrics.snapshot
+        self.log_interval = log_interval
+        self.stopped = threading.Event()
+        self.log_thread = None
+        self.server = None
+        if log_interval:
+            self.log_thread = threading.Thread(target=self.log_periodically, daemon=True)
+            self.log_thread.start()
+        if port is not None:
+            self.server = ThreadingHTTPServer((host, port), self.create_handler())
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.log_thread is not None:
+            self.log_thread.join()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def log_periodically(self):
+        while not self.stopped.wait(self.log_interval):
+            logger.info(json.dumps(self.snapshot_function()))
+
+    def create_handler(self):
+        metrics = self.metrics
+
+        class PrometheusHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return PrometheusHandler
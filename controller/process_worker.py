@@ -0,0 +1,169 @@
+import cv2
+import time
+import itertools
+import multiprocessing
+from queue import Queue, Empty
+from threading import Thread, Lock, Event
+from controller.face_recognizer import FaceRecognizer
+from utils.shared_buffer import SharedSlots
+from controller.batching import collect_batch
+from controller.metrics import Metrics
+from model.db_handler import DBHandler
+from model.face_model import Face
+
+
+class ProcessPool:
+    def __init__(self, request_queue, response_queue, num_workers=2, max_batch_size=8, max_batch_wait=0.005,
+                 num_slots=32, slot_size=512 * 512 * 3, metrics=None, poll_interval=0.5, join_timeout=5.0):
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.handler = DBHandler.get_instance()
+        self.slots = SharedSlots(num_slots, slot_size)
+        self.free_slots = Queue()
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+        # every dispatched crop gets a ticket, results of requests reclaimed after a worker died are ignored
+        self.pending = dict()
+        self.tickets = itertools.count()
+        self.lock = Lock()
+        self.poll_interval = poll_interval
+        self.join_timeout = join_timeout
+        self.stopped = Event()
+
+        # spawn avoids forking the Tk and TensorFlow state of the parent process
+        self.context = multiprocessing.get_context('spawn')
+        self.task_queue = self.context.Queue()
+        self.result_queue = self.context.Queue()
+        self.process_args = (self.task_queue, self.result_queue, self.slots.name, slot_size, max_batch_size,
+                             max_batch_wait, self.handler.get_config())
+        self.processes = [self.start_process() for i in range(num_workers)]
+
+        self.feeder = Thread(target=self.feed, daemon=True)
+        self.collector = Thread(target=self.collect, daemon=True)
+        self.feeder.start()
+        self.collector.start()
+
+    def start_process(self):
+        process = self.context.Process(target=run_process_worker, daemon=True, args=self.process_args)
+        process.start()
+        return process
+
+    def stop(self):
+        self.stopped.set()
+        self.request_queue.put(None)
+        self.feeder.join(self.join_timeout)
+        for process in self.processes:
+            process.join(self.join_timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join(self.join_timeout)
+        self.result_queue.put(None)
+        self.collector.join(self.join_timeout)
+        self.slots.close()
+
+    def feed(self):
+        while True:
+            try:
+                face = self.request_queue.get(timeout=self.poll_interval)
+            except Empty:
+                self.check_processes()
+                continue
+            if face is None:
+                break
+            slot = self.acquire_slot()
+            if slot is None:
+                self.fail_faces([face])
+                break
+            self.metrics.record('queue_wait', time.monotonic() - face.enqueued_at)
+            img = self.fit_to_slot(face.img)
+            self.slots.write(slot, img)
+            ticket = next(self.tickets)
+            with self.lock:
+                self.pending[slot] = (ticket, face, time.monotonic())
+            self.task_queue.put((slot, ticket, img.shape))
+        for process in self.processes:
+            self.task_queue.put(None)
+
+    def acquire_slot(self):
+        # slots of a crashed worker are never returned, so waiting for one also watches the worker processes
+        while not self.stopped.is_set():
+            try:
+                return self.free_slots.get(timeout=self.poll_interval)
+            except Empty:
+                self.check_processes()
+        return None
+
+    def check_processes(self):
+        dead = [i for i, process in enumerate(self.processes) if not process.is_alive()]
+        if not dead:
+            return
+        for i in dead:
+            self.metrics.increment('worker_restarts')
+            self.processes[i] = self.start_process()
+        # it is not known which crops the dead worker held, all dispatched ones are failed and their slots reused
+        with self.lock:
+            pending = list(self.pending.items())
+            self.pending.clear()
+        for slot, (ticket, face, dispatched_at) in pending:
+            self.free_slots.put(slot)
+        self.fail_faces([face for slot, (ticket, face, dispatched_at) in pending])
+
+    def fail_faces(self, faces):
+        if self.stopped.is_set():
+            # nobody collects responses any more, putting them could block the shutdown
+            return
+        for face in faces:
+            self.metrics.increment('failed_requests')
+            # no similarity marks the request as failed, the track stays in processing state and is queued again
+            face.identity, face.similarity, face.embedding = None, None, None
+            self.response_queue.put(face)
+
+    def collect(self):
+        while True:
+            result = self.result_queue.get()
+            if result is None:
+                break
+            slot, ticket, identity_id, similarity, embedding = result
+            with self.lock:
+                if slot not in self.pending or self.pending[slot][0] != ticket:
+                    continue
+                ticket, face, dispatched_at = self.pending.pop(slot)
+            self.free_slots.put(slot)
+            # stages inside child processes are not visible here, the whole round trip is recorded instead
+            self.metrics.record('recognition', time.monotonic() - dispatched_at)
+            face.identity = self.handler.get_identities().get(identity_id) if identity_id is not None else None
+            face.similarity = similarity
+            face.embedding = embedding
+            self.response_queue.put(face)
+
+    def fit_to_slot(self, img):
+        if img.nbytes <= self.slots.slot_size:
+            return img
+        scale = (self.slots.slot_size / img.nbytes) ** 0.5
+        height, width = int(img.shape[0] * scale), int(img.shape[1] * scale)
+        return cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def run_process_worker(task_queue, result_queue, shm_name, slot_size, max_batch_size, max_batch_wait, db_config):
+    slots = SharedSlots(0, slot_size, name=shm_name)
+    DBHandler.get_instance(**db_config)
+    face_rec = FaceRecognizer()
+    running = True
+    while running:
+        task = task_queue.get()
+        if task is None:
+            break
+        tasks, running = collect_batch(task_queue, task, max_batch_size, max_batch_wait)
+        for result in recognize_slots(face_rec, slots, tasks):
+            result_queue.put(result)
+    slots.close()
+
+
+def recognize_slots(face_rec, slots, tasks):
+    # crops are read straight from shared memory, the slot is released by the parent once the result arrives
+    face_rec.handler.refresh()
+    faces = [Face(slots.view(slot, shape), None) for slot, ticket, shape in tasks]
+    results = face_rec.recognize_faces(faces)
+    return [(slot, ticket, identity.identity_id if identity is not None else None, similarity, face.embedding)
+            for (slot, ticket, shape), face, (identity, similarity) in zip(tasks, faces, results)]
@@ -0,0 +1,106 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from queue import Empty
+
+POLICIES = ['drop_oldest', 'drop_newest', 'coalesce', 'priority']
+
+
+class RecognitionQueue:
+    def __init__(self, maxsize=10, policy='drop_oldest'):
+        if policy not in POLICIES:
+            raise ValueError('Invalid overflow policy: {}'.format(policy))
+        self.maxsize = maxsize
+        self.policy = policy
+        self.items = deque()
+        self.heap = list()
+        self.order = itertools.count()
+        self.sentinels = 0
+        self.not_empty = threading.Condition(threading.Lock())
+
+    def qsize(self):
+        with self.not_empty:
+            return len(self.heap) if self.policy == 'priority' else len(self.items)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def put(self, face, block=False, timeout=None):
+        # never blocks, faces that do not fit are returned to the caller instead
+        with self.not_empty:
+            if face is None:
+                self.sentinels += 1
+                dropped = []
+            elif self.policy == 'priority':
+                dropped = self.put_priority(face)
+            else:
+                dropped = self.put_fifo(face)
+            self.not_empty.notify()
+        return dropped
+
+    def put_nowait(self, face):
+        return self.put(face)
+
+    def replace(self, face):
+        # swaps a still queued request of the same track for the fresher crop, used by the coalesce policy
+        with self.not_empty:
+            for i, queued in enumerate(self.items):
+                if queued.face_id == face.face_id:
+                    self.items[i] = face
+                    return True
+        return False
+
+    def put_fifo(self, face):
+        if self.policy == 'coalesce':
+            for i, queued in enumerate(self.items):
+                if queued.face_id == face.face_id:
+                    self.items[i] = face
+                    return [queued]
+        if self.maxsize <= 0 or len(self.items) < self.maxsize:
+            self.items.append(face)
+            return []
+        if self.policy == 'drop_newest':
+            return [face]
+        dropped = self.items.popleft()
+        self.items.append(face)
+        return [dropped]
+
+    def put_priority(self, face):
+        # largest faces are usually the closest ones and are recognized first
+        entry = (-self.area(face), next(self.order), face)
+        if self.maxsize <= 0 or len(self.heap) < self.maxsize:
+            heapq.heappush(self.heap, entry)
+            return []
+        smallest = max(self.heap)
+        if entry > smallest:
+            return [face]
+        self.heap.remove(smallest)
+        heapq.heapify(self.heap)
+        heapq.heappush(self.heap, entry)
+        return [smallest[2]]
+
+    def get(self, block=True, timeout=None):
+        with self.not_empty:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self.items and not self.heap and self.sentinels == 0:
+                if not block:
+                    raise Empty
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise Empty
+                self.not_empty.wait(remaining)
+            if self.heap:
+                return heapq.heappop(self.heap)[2]
+            if self.items:
+                return self.items.popleft()
+            self.sentinels -= 1
+            return None
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def area(self, face):
+        (x, y, w, h) = face.coordinates
+        return w * h
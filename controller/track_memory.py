@@ -0,0 +1,118 @@
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from model import face_model as fm
+
+
+class MemoryEntry:
+    def __init__(self, face, embedding):
+        self.face_id = face.face_id
+        self.face = face
+        self.identity = face.identity
+        self.similarity = face.similarity
+        self.state = face.state
+        self.embedding = None
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype=np.float32)
+            self.embedding = embedding / max(np.linalg.norm(embedding), 1e-12)
+        self.remembered_at = time.monotonic()
+        self.last_seen = self.remembered_at
+        self.active = True
+
+
+class TrackMemory:
+    def __init__(self, capacity=64, ttl=10.0, max_age=60.0, max_center_distance=1.0, embedding_threshold=0.6,
+                 confirm_votes=2):
+        self.capacity = capacity
+        self.ttl = ttl
+        # entries of tracks that are still present expire too, so identities are re-checked against the gallery
+        self.max_age = max_age
+        self.max_center_distance = max_center_distance
+        self.embedding_threshold = embedding_threshold
+        self.confirm_votes = confirm_votes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def remember(self, face, embedding):
+        with self.lock:
+            self.entries[face.face_id] = MemoryEntry(face, embedding)
+            self.entries.move_to_end(face.face_id)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def release(self, face):
+        # a lost track keeps its last box and crop, so it can be recognized again without inference
+        with self.lock:
+            entry = self.entries.get(face.face_id)
+            if entry is None:
+                return
+            entry.face = face
+            entry.last_seen = time.monotonic()
+            entry.active = False
+            self.entries.move_to_end(face.face_id)
+
+    def forget(self, face_id):
+        with self.lock:
+            self.entries.pop(face_id, None)
+
+    def recall(self, new_face, compare_faces, sim_threshold):
+        with self.lock:
+            self.evict_expired()
+            best, max_similarity = None, sim_threshold
+            for entry in self.entries.values():
+                if entry.active or self.center_distance(new_face, entry.face) > self.max_center_distance:
+                    continue
+                similarity = compare_faces(new_face, entry.face)
+                if similarity >= max_similarity:
+                    best, max_similarity = entry, similarity
+            if best is not None:
+                best.active = True
+                best.last_seen = time.monotonic()
+                self.entries.move_to_end(best.face_id)
+            return best
+
+    def confirm(self, face, compare_faces, sim_threshold):
+        # a recalled track has to look like the remembered face on several detection cycles before it is trusted
+        with self.lock:
+            entry = self.entries.get(face.face_id)
+        if entry is None or compare_faces(face, entry.face) < sim_threshold:
+            return False
+        face.votes_needed -= 1
+        return True
+
+    def match_embedding(self, embedding, identities):
+        # identities renamed or deleted since they were remembered are taken from, or skipped by, the current mapping
+        with self.lock:
+            self.evict_expired()
+            entries = [entry for entry in self.entries.values() if entry.embedding is not None
+                       and entry.state == fm.RECOGNIZED and entry.identity.identity_id in identities]
+        if not entries:
+            return None, -1
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / max(np.linalg.norm(vector), 1e-12)
+        similarities = np.stack([entry.embedding for entry in entries]) @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.embedding_threshold:
+            return None, -1
+        return identities[entries[best].identity.identity_id], float(similarities[best])
+
+    def evict_expired(self):
+        now = time.monotonic()
+        expired = [face_id for face_id, entry in self.entries.items() if now - entry.remembered_at > self.max_age
+                   or (not entry.active and now - entry.last_seen > self.ttl)]
+        for face_id in expired:
+            del self.entries[face_id]
+
+    def center_distance(self, face_a, face_b):
+        (ax, ay, aw, ah) = face_a.coordinates
+        (bx, by, bw, bh) = face_b.coordinates
+        distance = np.hypot((ax + aw / 2) - (bx + bw / 2), (ay + ah / 2) - (by + bh / 2))
+        return distance / max(bw, bh, 1)
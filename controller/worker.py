@@ -1,19 +1,45 @@
+import time
+import logging
 from controller.face_recognizer import FaceRecognizer
+from controller.batching import collect_batch
+from controller.metrics import Metrics
 from threading import Thread
 
+logger = logging.getLogger(__name__)
+
 
 class Worker(Thread):
-    def __init__(self, request_queue, response_queue):
+    def __init__(self, request_queue, response_queue, max_batch_size=8, max_batch_wait=0.005, metrics=None,
+                 memory=None):
         super().__init__()
         self.request_queue = request_queue
         self.response_queue = response_queue
-        self.face_rec = FaceRecognizer()
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.face_rec = FaceRecognizer(metrics=self.metrics, memory=memory)
 
     def run(self):
-        while True:
+        running = True
+        while running:
             face = self.request_queue.get()
             if face is None:
                 break
-            identity = self.face_rec.recognize_face(face)
-            face.identity = identity
-            self.response_queue.put(face)
+            batch, running = collect_batch(self.request_queue, face, self.max_batch_size, self.max_batch_wait)
+            now = time.monotonic()
+            for queued in batch:
+                self.metrics.record('queue_wait', now - queued.enqueued_at)
+            self.metrics.increment('batches')
+            try:
+                results = self.face_rec.recognize_faces(batch)
+            except Exception:
+                # the worker keeps running, faces without similarity are failed requests the controller retries
+                logger.exception('Recognition of %d faces failed', len(batch))
+                self.metrics.increment('failed_requests', len(batch))
+                results = [(None, None)] * len(batch)
+                for face in batch:
+                    face.embedding = None
+            for face, (identity, similarity) in zip(batch, results):
+                face.identity = identity
+                face.similarity = similarity
+                self.response_queue.put(face)
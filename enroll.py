@@ -0,0 +1,41 @@
+import argparse
+import csv
+import time
+
+from controller.identity_controller import IdentityController
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--source', default='', type=str, help='directory or zip laid out as name_surname/*.jpg, or CSV manifest')
+parser.add_argument('--num_workers', default=4, type=int, help='number of threads decoding and aligning images')
+parser.add_argument('--batch_size', default=32, type=int, help='number of faces embedded at once')
+parser.add_argument('--failures', default='', type=str, help='optional path to write failed files as CSV')
+
+
+def main():
+    global args
+    args = parser.parse_args()
+
+    if not args.source:
+        raise ValueError('Please specify directory, zip archive or CSV manifest')
+
+    controller = IdentityController()
+    start = time.perf_counter()
+    try:
+        report = controller.add_identities(args.source, num_workers=args.num_workers, batch_size=args.batch_size)
+    finally:
+        elapsed = time.perf_counter() - start
+        controller.close()
+
+    print('Enrolled {} identities from {} files in {:.2f} s'.format(len(report.identities), report.num_files, elapsed))
+    print('Failed files: {}'.format(len(report.failures)))
+    for file_name, reason in report.failures:
+        print('{}: {}'.format(file_name, reason))
+    if args.failures:
+        with open(args.failures, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['file', 'reason'])
+            writer.writerows(report.failures)
+
+
+if __name__ == '__main__':
+    main()
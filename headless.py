@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+import time
+import cv2
+
+from controller.frame_controller import FrameController
+from model import face_model as fm
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--source', default='', type=str, help='video file, stream URL, camera index or directory of frames')
+parser.add_argument('--output', default='annotations.jsonl', type=str, help='path to write per-frame JSONL annotations')
+parser.add_argument('--frame_proc_freq', default=1, type=int, help='run detection on every n-th frame')
+parser.add_argument('--num_workers', default=2, type=int, help='number of recognition workers')
+parser.add_argument('--execution_mode', default='thread', type=str, help='recognition workers: thread or process')
+parser.add_argument('--tracking', default='iou', type=str, help='face correlation method: iou or ssim')
+parser.add_argument('--detection_scale', default=1.0, type=float, help='scale of frames used for full detection scans')
+parser.add_argument('--full_scan_period', default=1, type=int, help='number of detection cycles between full scans')
+parser.add_argument('--aggregation', default='max', type=str,
+                    help='score of identities with several templates: max, mean or centroid')
+parser.add_argument('--index_probes', default=8, type=int,
+                    help='number of IVF lists scanned per query, trades recall for latency')
+parser.add_argument('--drain_timeout', default=10.0, type=float,
+                    help='seconds to wait for recognitions still in flight once the input has ended')
+
+STATE_NAMES = {fm.PROCESSING: 'processing', fm.UNKNOWN: 'unknown', fm.RECOGNIZED: 'recognized'}
+IMG_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def main():
+    global args
+    args = parser.parse_args()
+
+    if not args.source:
+        raise ValueError('Please specify video file, stream or directory of frames')
+
+    controller = FrameController(frame_proc_freq=args.frame_proc_freq,
+                                 num_workers=args.num_workers,
+                                 execution_mode=args.execution_mode,
+                                 tracking=args.tracking,
+                                 detection_scale=args.detection_scale,
+                                 full_scan_period=args.full_scan_period,
+                                 aggregation=args.aggregation,
+                                 index_probes=args.index_probes)
+
+    num_frames, track_ids = 0, set()
+    start = time.perf_counter()
+    try:
+        with open(args.output, 'w') as output:
+            # every frame is written once the next one arrives, so the last one can still be updated
+            record = None
+            for frame in read_frames(args.source):
+                controller.process_frame(frame, render=False)
+                if record is not None:
+                    output.write(json.dumps(record) + '\n')
+                record = annotate_frame(controller, num_frames, track_ids)
+                num_frames += 1
+            if record is not None:
+                # recognitions still in flight when the input ends are reported on the last frame
+                if not controller.wait_for_results(args.drain_timeout):
+                    print('Timed out waiting for {} recognitions'.format(len(controller.pending_ids)))
+                output.write(json.dumps(annotate_frame(controller, num_frames - 1, track_ids)) + '\n')
+    finally:
+        elapsed = time.perf_counter() - start
+        controller.stop()
+
+    print('Processed {} frames in {:.2f} s'.format(num_frames, elapsed))
+    print('Throughput: {:.2f} frames/s'.format(num_frames / elapsed if elapsed > 0 else 0))
+    print('Tracks seen: {}'.format(len(track_ids)))
+    for stage, timing in controller.get_stats()['timings'].items():
+        print('{:<20} mean {:8.2f} ms  p95 {:8.2f} ms  ({} samples)'
+              .format(stage, timing['mean_ms'], timing['p95_ms'], timing['count']))
+
+
+def read_frames(source):
+    if os.path.isdir(source):
+        for filename in sorted(os.listdir(source)):
+            if filename.lower().endswith(IMG_EXTENSIONS):
+                frame = cv2.imread(os.path.join(source, filename))
+                if frame is not None:
+                    yield frame
+        return
+
+    capture = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not capture.isOpened():
+        raise ValueError('Unable to open source: {}'.format(source))
+    try:
+        while True:
+            check, frame = capture.read()
+            if not check:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+
+def annotate_frame(controller, frame_no, track_ids):
+    faces = [annotate_face(face) for face in controller.present_faces.values()]
+    track_ids.update(face['track_id'] for face in faces)
+    return {'frame': frame_no, 'faces': faces}
+
+
+def annotate_face(face):
+    (x, y, w, h) = face.coordinates
+    identity = None
+    # recalled tracks carry their identity before it is confirmed
+    if face.state == fm.RECOGNIZED:
+        identity = {'id': face.identity.identity_id, 'name': face.identity.name, 'surname': face.identity.surname}
+    return {
+        'track_id': face.face_id,
+        'box': [int(x), int(y), int(w), int(h)],
+        'state': STATE_NAMES[face.state],
+        'identity': identity,
+        'score': float(face.similarity) if face.similarity is not None else None
+    }
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,35 @@
+import os
 import sqlite3
+import threading
 import numpy as np
+from concurrent.futures import Future
+from queue import Queue, Empty
 from model.identity_model import Identity
+from model.gallery import Gallery, centroid
+from model.ivf_index import IVFIndex
+
+SCHEMA_VERSION = 2
+# feature_version values stored per row
+TEXT_FEATURES = 0
+FLOAT32_FEATURES = 1
 
 
 class Singleton:
     def __init__(self, cls):
         self._cls = cls
+        self._lock = threading.Lock()
 
-    def get_instance(self):
-        try:
-            return self._instance
-        except AttributeError:
-            self._instance = self._cls()
-            return self._instance
+    def get_instance(self, **kwargs):
+        # keyword arguments configure the instance when it is created, later calls may only repeat the same values
+        with self._lock:
+            if not hasattr(self, '_instance'):
+                self._instance = self._cls(**kwargs)
+                return self._instance
+        conflicting = [key for key, value in kwargs.items() if getattr(self._instance, key) != value]
+        if conflicting:
+            raise ValueError('{} was already created with different {}'
+                             .format(self._cls.__name__, ', '.join(sorted(conflicting))))
+        return self._instance
 
     def __call__(self):
         raise TypeError('Singletons must be accessed through `get_instance()`.')
@@ -23,53 +40,403 @@ class Singleton:
 
 @Singleton
 class DBHandler:
-    def __init__(self):
-        self.connection = sqlite3.connect('resources/identitydb')
-        self.identities = self.load_identities()
+    def __init__(self, db_path='resources/identitydb', use_index=True, index_min_size=10_000, index_probes=8,
+                 use_snapshot=True, max_write_batch=256, aggregation='max'):
+        self.db_path = db_path
+        self.index_path = db_path + '-ivf.npz'
+        self.snapshot_path = db_path + '-gallery.npy'
+        self.snapshot_meta_path = db_path + '-gallery-meta.npz'
+        self.use_snapshot = use_snapshot
+        self.use_index = use_index
+        self.index_min_size = index_min_size
+        self.index_probes = index_probes
+        self.aggregation = aggregation
+        self.max_write_batch = max_write_batch
+        self.closed = False
+        # readers share one connection guarded by a lock, all writes go through the writer thread and its own one
+        self.lock = threading.RLock()
+        self.connection = self.connect()
+        self.migrate()
+        self.load()
+        self.write_connection = self.connect(isolation_level=None)
+        self.write_queue = Queue()
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def get_config(self):
+        # used to create handlers with the same settings in other processes
+        return {'db_path': self.db_path, 'use_index': self.use_index, 'index_min_size': self.index_min_size,
+                'index_probes': self.index_probes, 'use_snapshot': self.use_snapshot, 'aggregation': self.aggregation}
 
     def __del__(self):
         self.connection.close()
 
+    def connect(self, isolation_level=''):
+        connection = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=isolation_level)
+        # WAL lets readers proceed while a batch is written, NORMAL syncs on checkpoints instead of every commit
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def load(self):
+        with self.lock:
+            revision = self.get_revision()
+            identities, templates = self.load_identities()
+        gallery = Gallery.from_templates(*templates, aggregation=self.aggregation)
+        # the index finds the best single template, so it only serves max aggregation
+        if self.use_index and self.aggregation == 'max':
+            gallery.set_index(self.load_index(gallery, self.index_min_size, self.index_probes))
+        self.set_state(identities, gallery, revision)
+
+    def set_state(self, identities, gallery, revision):
+        # identities are swapped before the gallery so that every id matched in the new gallery resolves
+        self.identities = identities
+        self.gallery = gallery
+        self.revision = revision
+
+    def refresh(self):
+        # used by handlers living in other processes to pick up changes committed by the main one
+        if self.get_revision() != self.revision:
+            self.load()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.write_queue.put(None)
+        self.writer.join()
+        self.save_index()
+        self.save_snapshot()
+        self.connection.close()
+
+    def migrate(self):
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        if version < 1:
+            self.migrate_features()
+        if version < 2:
+            self.migrate_templates()
+        self.connection.execute('VACUUM')
+
+    def migrate_features(self):
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(identities)')]
+        with self.connection:
+            if 'feature_dim' not in columns:
+                self.connection.execute('ALTER TABLE identities ADD COLUMN feature_dim integer')
+                self.connection.execute('ALTER TABLE identities ADD COLUMN feature_version integer not null default {}'
+                                        .format(TEXT_FEATURES))
+            rows = self.connection.execute('SELECT identity_id, feature_vector FROM identities '
+                                           'WHERE feature_version = ?', (TEXT_FEATURES,)).fetchall()
+            for identity_id, str_features in rows:
+                features = np.fromstring(str_features, dtype=np.float32, sep=',')
+                self.connection.execute('UPDATE identities SET feature_vector = ?, feature_dim = ?, feature_version = ? '
+                                        'WHERE identity_id = ?', (*self.encode_features(features), identity_id))
+
+            # revision counter lets cached gallery snapshots detect any change made to the table
+            self.connection.execute('CREATE TABLE IF NOT EXISTS gallery_meta (revision integer not null)')
+            if self.connection.execute('SELECT count(*) FROM gallery_meta').fetchone()[0] == 0:
+                self.connection.execute('INSERT INTO gallery_meta (revision) VALUES (0)')
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                self.connection.execute('CREATE TRIGGER IF NOT EXISTS identities_{0}_revision AFTER {1} ON identities '
+                                        'BEGIN UPDATE gallery_meta SET revision = revision + 1; END'
+                                        .format(event.lower(), event))
+            self.connection.execute('PRAGMA user_version = 1')
+
+    def migrate_templates(self):
+        with self.connection:
+            # identities keep the centroid of their templates in feature_vector, the templates themselves live here
+            self.connection.execute('CREATE TABLE IF NOT EXISTS templates (template_id integer not null '
+                                    'constraint templates_pk primary key autoincrement, identity_id integer not null, '
+                                    'feature_vector blob not null, feature_dim integer not null)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS templates_identity_id ON templates (identity_id)')
+            self.connection.execute('INSERT INTO templates (identity_id, feature_vector, feature_dim) '
+                                    'SELECT identity_id, feature_vector, feature_dim FROM identities')
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                self.connection.execute('CREATE TRIGGER IF NOT EXISTS templates_{0}_revision AFTER {1} ON templates '
+                                        'BEGIN UPDATE gallery_meta SET revision = revision + 1; END'
+                                        .format(event.lower(), event))
+            # snapshots written before templates existed must not be reused
+            self.connection.execute('UPDATE gallery_meta SET revision = revision + 1')
+            self.connection.execute('PRAGMA user_version = 2')
+
+    def get_revision(self):
+        with self.lock:
+            return self.connection.execute('SELECT revision FROM gallery_meta').fetchone()[0]
+
+    def encode_features(self, features):
+        vector = np.asarray(features, dtype='<f4').ravel()
+        return vector.tobytes(), vector.shape[0], FLOAT32_FEATURES
+
+    def decode_features(self, blob, dim):
+        features = np.frombuffer(blob, dtype='<f4')
+        if features.shape[0] != dim:
+            raise ValueError('Corrupted feature vector: expected {} values, found {}'.format(dim, features.shape[0]))
+        return features
+
+    def load_index(self, gallery, min_size, n_probe):
+        index = IVFIndex(n_probe=n_probe, min_size=min_size)
+        # a missing or stale index file is not an error, the index is simply retrained from the gallery
+        if len(gallery) >= min_size:
+            index.load(self.index_path, gallery)
+        return index
+
+    def save_index(self):
+        if self.gallery.index is not None:
+            self.gallery.index.save(self.index_path)
+
     def get_identities(self):
         return self.identities
 
+    def get_gallery(self):
+        return self.gallery
+
     def add_identity(self, identity):
-        str_features = ','.join(map(str, identity.features))
-        cursor = self.connection.cursor()
-        cursor.execute('INSERT INTO identities (name, surname, feature_vector) VALUES (?,?,?)',
-                       (identity.name, identity.surname, str_features))
-        self.connection.commit()
-        identity.identity_id = cursor.lastrowid
-        self.identities[identity.identity_id] = identity
+        self.submit_write(self.write_add, [identity]).result()
+
+    def add_identities(self, identities):
+        # bulk enrollment writes every row in a single transaction and grows the gallery in one step
+        if identities:
+            self.submit_write(self.write_add, list(identities)).result()
 
     def edit_identity(self, identity):
-        cursor = self.connection.cursor()
-        if identity.features is not None:
-            str_features = ','.join(map(str, identity.features))
+        self.submit_write(self.write_edit, identity).result()
+
+    def add_templates(self, identity_id, templates):
+        self.submit_write(self.write_templates, (identity_id, templates)).result()
+
+    def delete_identity(self, identity_id):
+        self.submit_write(self.write_delete, identity_id).result()
+
+    def submit_write(self, operation, argument):
+        if self.closed:
+            raise RuntimeError('Database handler is closed')
+        future = Future()
+        self.write_queue.put((operation, argument, future))
+        return future
+
+    def write_loop(self):
+        running = True
+        while running:
+            request = self.write_queue.get()
+            if request is None:
+                break
+            requests = [request]
+            # whatever was queued in the meantime is committed in the same transaction
+            while len(requests) < self.max_write_batch:
+                try:
+                    request = self.write_queue.get_nowait()
+                except Empty:
+                    break
+                if request is None:
+                    running = False
+                    break
+                requests.append(request)
+            self.write_batch(requests)
+        self.write_connection.close()
+
+    def write_batch(self, requests):
+        # requests are applied to copies of the in-memory state, readers keep using the old ones until the swap
+        results = list()
+        stale = False
+        cursor = self.write_connection.cursor()
+        try:
+            identities = dict(self.identities)
+            gallery = self.gallery.copy()
+            cursor.execute('BEGIN')
+            for operation, argument, future in requests:
+                # a failing request is rolled back on its own and does not abort the rest of the batch
+                cursor.execute('SAVEPOINT write_request')
+                changes = gallery.changes
+                try:
+                    results.append((future, operation(cursor, argument, identities, gallery)))
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO write_request')
+                    future.set_exception(e)
+                    # the gallery cannot be rolled back, it is reloaded from the database once the batch is committed
+                    stale = stale or gallery.changes != changes
+                cursor.execute('RELEASE write_request')
+            cursor.execute('COMMIT')
+            if stale:
+                self.load()
+            else:
+                self.set_state(identities, gallery, cursor.execute('SELECT revision FROM gallery_meta').fetchone()[0])
+        except Exception as e:
+            # the writer thread keeps running, every request of the batch that is still waiting is failed
+            if self.write_connection.in_transaction:
+                self.write_connection.rollback()
+            for operation, argument, future in requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result in results:
+            future.set_result(result)
+
+    def write_add(self, cursor, new_identities, identities, gallery):
+        template_ids, owners = list(), list()
+        for identity in new_identities:
+            self.prepare_templates(identity, gallery.dim)
+            cursor.execute('INSERT INTO identities (name, surname, feature_vector, feature_dim, feature_version) '
+                           'VALUES (?,?,?,?,?)',
+                           (identity.name, identity.surname, *self.encode_features(identity.features)))
+            identity.identity_id = cursor.lastrowid
+            template_ids += self.insert_templates(cursor, identity.identity_id, identity.templates)
+            owners += [identity.identity_id] * len(identity.templates)
+        gallery.extend(template_ids, np.concatenate([identity.templates for identity in new_identities]), owners)
+        for identity in new_identities:
+            identities[identity.identity_id] = identity
+        return [identity.identity_id for identity in new_identities]
+
+    def write_edit(self, cursor, identity, identities, gallery):
+        if identity.identity_id not in identities:
+            raise KeyError('Unknown identity: {}'.format(identity.identity_id))
+        if identity.features is not None or identity.templates is not None:
+            # a new photo replaces all templates of the identity
+            self.prepare_templates(identity, gallery.dim)
             sql = 'UPDATE identities ' \
-                  'SET name = ?, surname = ?, feature_vector = ? ' \
+                  'SET name = ?, surname = ?, feature_vector = ?, feature_dim = ?, feature_version = ? ' \
                   'WHERE identity_id = ?'
-            cursor.execute(sql, (identity.name, identity.surname, str_features, identity.identity_id))
+            cursor.execute(sql, (identity.name, identity.surname, *self.encode_features(identity.features),
+                                 identity.identity_id))
+            cursor.execute('DELETE FROM templates WHERE identity_id = ?', (identity.identity_id,))
+            template_ids = self.insert_templates(cursor, identity.identity_id, identity.templates)
+            gallery.remove_owner(identity.identity_id)
+            gallery.extend(template_ids, identity.templates, [identity.identity_id] * len(template_ids))
         else:
             sql = 'UPDATE identities ' \
                   'SET name = ?, surname = ? ' \
                   'WHERE identity_id = ?'
             cursor.execute(sql, (identity.name, identity.surname, identity.identity_id))
-            identity.features = self.identities[identity.identity_id].features
-        self.connection.commit()
-        self.identities[identity.identity_id] = identity
+            identity.features = identities[identity.identity_id].features
+            identity.templates = identities[identity.identity_id].templates
+        identities[identity.identity_id] = identity
+        return identity.identity_id
 
-    def delete_identity(self, identity_id):
-        sql = 'DELETE FROM identities WHERE identity_id = ?'
-        cur = self.connection.cursor()
-        cur.execute(sql, (identity_id,))
-        self.connection.commit()
-        del self.identities[identity_id]
+    def write_templates(self, cursor, request, identities, gallery):
+        identity_id, templates = request
+        if identity_id not in identities:
+            raise KeyError('Unknown identity: {}'.format(identity_id))
+        current = identities[identity_id]
+        templates = np.atleast_2d(np.asarray(templates, dtype=np.float32))
+        current_templates = current.templates if current.templates is not None else templates[:0]
+        # readers may still hold the current identity, so a new object is created instead of modifying it
+        identity = Identity(name=current.name, surname=current.surname, identity_id=identity_id,
+                            templates=np.concatenate([current_templates, templates]))
+        self.prepare_templates(identity, gallery.dim)
+        cursor.execute('UPDATE identities SET feature_vector = ?, feature_dim = ?, feature_version = ? '
+                       'WHERE identity_id = ?', (*self.encode_features(identity.features), identity_id))
+        template_ids = self.insert_templates(cursor, identity_id, templates)
+        gallery.extend(template_ids, templates, [identity_id] * len(template_ids))
+        identities[identity_id] = identity
+        return template_ids
+
+    def write_delete(self, cursor, identity_id, identities, gallery):
+        if identity_id not in identities:
+            raise KeyError('Unknown identity: {}'.format(identity_id))
+        cursor.execute('DELETE FROM identities WHERE identity_id = ?', (identity_id,))
+        cursor.execute('DELETE FROM templates WHERE identity_id = ?', (identity_id,))
+        gallery.remove_owner(identity_id)
+        del identities[identity_id]
+        return identity_id
+
+    def prepare_templates(self, identity, dim=None):
+        # a single feature vector is treated as one template, the identity keeps the centroid of its templates
+        templates = identity.templates if identity.templates is not None else identity.features
+        templates = np.atleast_2d(np.asarray(templates, dtype=np.float32))
+        if dim is not None and templates.shape[1] != dim:
+            raise ValueError('Feature vector has {} values, gallery expects {}'.format(templates.shape[1], dim))
+        identity.templates = templates
+        identity.features = centroid(identity.templates)
+
+    def insert_templates(self, cursor, identity_id, templates):
+        template_ids = list()
+        for template in templates:
+            vector, dim = self.encode_features(template)[:2]
+            cursor.execute('INSERT INTO templates (identity_id, feature_vector, feature_dim) VALUES (?,?,?)',
+                           (identity_id, vector, dim))
+            template_ids.append(cursor.lastrowid)
+        return template_ids
 
     def load_identities(self):
-        cursor = self.connection.cursor()
+        with self.lock:
+            if self.use_snapshot:
+                loaded = self.load_snapshot()
+                if loaded is not None:
+                    return loaded
+            return self.read_identities()
+
+    def read_identities(self):
+        template_ids, owners, vectors = list(), list(), list()
+        for template_id, identity_id, blob, dim in self.connection.execute(
+                'SELECT template_id, identity_id, feature_vector, feature_dim FROM templates '
+                'ORDER BY identity_id, template_id'):
+            template_ids.append(template_id)
+            owners.append(identity_id)
+            vectors.append(self.decode_features(blob, dim))
+        matrix = np.stack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+        templates = (np.array(template_ids, dtype=np.int64), np.array(owners, dtype=np.int64), matrix)
+        return self.build_identities(templates), templates
+
+    def build_identities(self, templates):
+        # templates are sorted by owner, so every identity gets a contiguous slice of the matrix
+        template_ids, owners, matrix = templates
+        owner_ids, starts, counts = np.unique(owners, return_index=True, return_counts=True)
+        slices = dict()
+        if len(owner_ids):
+            normalized = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            sums = np.add.reduceat(normalized, starts, axis=0)
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+            slices = dict(zip(owner_ids.tolist(), zip(starts.tolist(), (starts + counts).tolist(), centroids)))
+
         identities = dict()
-        for row in cursor.execute('SELECT * FROM identities'):
-            features = np.fromstring(row[3], dtype=np.float32, sep=',')
-            identities[row[0]] = Identity(name=row[1], surname=row[2], identity_id=row[0], features=features)
+        for identity_id, name, surname in self.connection.execute('SELECT identity_id, name, surname FROM identities'):
+            features, identity_templates = None, None
+            if identity_id in slices:
+                start, end, features = slices[identity_id]
+                identity_templates = matrix[start:end]
+            identities[identity_id] = Identity(name=name, surname=surname, identity_id=identity_id,
+                                               features=features, templates=identity_templates)
         return identities
+
+    def load_snapshot(self):
+        if not os.path.exists(self.snapshot_path) or not os.path.exists(self.snapshot_meta_path):
+            return None
+        with np.load(self.snapshot_meta_path) as meta:
+            if 'owners' not in meta.files:
+                return None
+            template_ids, owners, revision = meta['ids'], meta['owners'], int(meta['revision'])
+        if revision != self.get_revision():
+            return None
+
+        # template rows of the mapped matrix are used directly, nothing is parsed
+        templates = (template_ids, owners, np.load(self.snapshot_path, mmap_mode='r'))
+        identities = self.build_identities(templates)
+        if any(identity.templates is None for identity in identities.values()):
+            return None
+        return identities, templates
+
+    def save_snapshot(self):
+        if not self.use_snapshot:
+            return
+        gallery, revision = self.gallery, self.revision
+        if len(gallery) == 0:
+            return
+        if os.path.exists(self.snapshot_meta_path):
+            with np.load(self.snapshot_meta_path) as meta:
+                if int(meta['revision']) == revision:
+                    return
+
+        template_ids, matrix = gallery.get_vectors()
+        # rows are stored grouped by owner so that loaded identities can take slices of the mapped matrix
+        order = np.argsort(gallery.get_owners(), kind='stable')
+        try:
+            # write to temporary files first so that a crash never leaves a half written snapshot behind
+            with open(self.snapshot_path + '.tmp', 'wb') as f:
+                np.save(f, matrix[order])
+            with open(self.snapshot_meta_path + '.tmp', 'wb') as f:
+                np.savez(f, ids=template_ids[order], owners=gallery.get_owners()[order], revision=revision)
+            os.replace(self.snapshot_path + '.tmp', self.snapshot_path)
+            os.replace(self.snapshot_meta_path + '.tmp', self.snapshot_meta_path)
+        except OSError:
+            # e.g. the previous snapshot is still memory-mapped on Windows, rows will be parsed on next start
+            pass
@@ -1,7 +1,11 @@
+import cv2
+
 PROCESSING = 0
 UNKNOWN = 1
 RECOGNIZED = 2
 
+DESCRIPTOR_SIZE = (64, 64)
+
 
 class Face:
     def __init__(self, img, coordinates, face_id='', identity=None, state=PROCESSING):
@@ -10,3 +14,17 @@ class Face:
         self.face_id = face_id
         self.identity = identity
         self.state = state
+        self.similarity = None
+        self.descriptor = None
+        self.first_seen = None
+        self.enqueued_at = None
+        self.embedding = None
+        self.votes_needed = 0
+
+    def get_descriptor(self):
+        # face pixels never change, so the blurred thumbnail is computed once per detection
+        if self.descriptor is None:
+            gray = cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY)
+            resized = cv2.resize(gray, DESCRIPTOR_SIZE, interpolation=cv2.INTER_AREA)
+            self.descriptor = cv2.bilateralFilter(cv2.medianBlur(resized, 5), 5, 75, 75)
+        return self.descriptor
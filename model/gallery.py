@@ -0,0 +1,242 @@
+import copy
+import numpy as np
+
+AGGREGATIONS = ('max', 'mean', 'centroid')
+
+
+class Gallery:
+    def __init__(self, dim=None, capacity=64, index=None, aggregation='max'):
+        if aggregation not in AGGREGATIONS:
+            raise ValueError('Invalid aggregation: {}'.format(aggregation))
+        self.dim = dim
+        self.size = 0
+        self.matrix = None if dim is None else np.empty((capacity, dim), dtype=np.float32)
+        self.ids = np.empty(capacity, dtype=np.int64)
+        # rows are templates, owners holds the identity each template belongs to
+        self.owners = np.empty(capacity, dtype=np.int64)
+        self.rows = dict()
+        self.index = index
+        self.aggregation = aggregation
+        self.segments = None
+        self.owner_centroids = None
+        self.changes = 0
+        # arrays may be shared with copies: rows below shared_size can be read by them and only the gallery owning
+        # the tail may append past its size
+        self.shared_size = 0
+        self.owns_tail = True
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, template_id):
+        return template_id in self.rows
+
+    def get_vectors(self):
+        if self.matrix is None:
+            return self.ids[:0], np.empty((0, 0), dtype=np.float32)
+        return self.ids[:self.size], self.matrix[:self.size]
+
+    def get_vector(self, template_id):
+        return self.matrix[self.rows[template_id]]
+
+    def get_owner(self, template_id):
+        return int(self.owners[self.rows[template_id]])
+
+    def get_owners(self):
+        return self.owners[:self.size]
+
+    def add(self, template_id, features, owner=None):
+        if template_id in self.rows:
+            self.update(template_id, features)
+            return
+        vector = self.normalize(features)
+        if self.matrix is None:
+            self.dim = vector.shape[0]
+            self.matrix = np.empty((len(self.ids), self.dim), dtype=np.float32)
+        self.reserve(self.size + 1)
+        self.make_writable(self.size)
+        self.matrix[self.size] = vector
+        self.ids[self.size] = template_id
+        self.owners[self.size] = template_id if owner is None else owner
+        self.rows[template_id] = self.size
+        self.size += 1
+        self.invalidate()
+        self.index_added(template_id, vector)
+
+    def extend(self, template_ids, features, owners=None):
+        if len(template_ids) == 0:
+            return
+        vectors = np.asarray(features, dtype=np.float32).reshape(len(template_ids), -1)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        if self.matrix is None:
+            self.dim = vectors.shape[1]
+            self.matrix = np.empty((len(self.ids), self.dim), dtype=np.float32)
+        start = self.size
+        self.reserve(start + len(template_ids))
+        self.make_writable(start)
+        self.matrix[start:start + len(template_ids)] = vectors
+        self.ids[start:start + len(template_ids)] = template_ids
+        self.owners[start:start + len(template_ids)] = template_ids if owners is None else owners
+        for row, template_id in enumerate(template_ids, start):
+            self.rows[int(template_id)] = row
+        self.size += len(template_ids)
+        self.invalidate()
+        if self.index is not None and self.index.trained:
+            self.index.extend(template_ids, vectors)
+        self.check_index()
+
+    def update(self, template_id, features):
+        vector = self.normalize(features)
+        row = self.rows[template_id]
+        self.make_writable(row)
+        self.matrix[row] = vector
+        self.invalidate()
+        if self.index is not None and self.index.trained:
+            self.index.remove(template_id)
+            self.index.add(template_id, vector)
+
+    def remove(self, template_id):
+        row = self.rows.pop(template_id)
+        last = self.size - 1
+        if row != last:
+            self.make_writable(row)
+            # move last row into the freed slot so that the active rows stay contiguous
+            self.matrix[row] = self.matrix[last]
+            self.ids[row] = self.ids[last]
+            self.owners[row] = self.owners[last]
+            self.rows[int(self.ids[row])] = row
+        self.size = last
+        self.invalidate()
+        if self.index is not None and self.index.trained:
+            self.index.remove(template_id)
+
+    def remove_owner(self, owner):
+        for template_id in self.ids[:self.size][self.owners[:self.size] == owner].tolist():
+            self.remove(template_id)
+
+    def match(self, features):
+        if self.size == 0:
+            return None, -1
+        vector = self.normalize(features)
+        # the index returns the best single template, which is exactly what max aggregation asks for
+        if self.aggregation == 'max' and self.index is not None and self.index.trained \
+                and self.size >= self.index.min_size:
+            template_id, similarity = self.index.search(vector)
+            return (self.get_owner(template_id) if template_id is not None else None), similarity
+        return self.aggregated_match(vector)
+
+    def exact_match(self, features):
+        if self.size == 0:
+            return None, -1
+        similarities = self.matrix[:self.size] @ self.normalize(features)
+        best = int(np.argmax(similarities))
+        return int(self.ids[best]), float(similarities[best])
+
+    def aggregated_match(self, vector):
+        owner_ids, codes, counts = self.get_segments()
+        if len(owner_ids) == self.size:
+            # one template per identity, every aggregation reduces to the best row
+            similarities = self.matrix[:self.size] @ vector
+            best = int(np.argmax(similarities))
+            return int(self.owners[best]), float(similarities[best])
+
+        if self.aggregation == 'centroid':
+            scores = self.get_owner_centroids() @ vector
+        else:
+            similarities = self.matrix[:self.size] @ vector
+            if self.aggregation == 'mean':
+                scores = np.bincount(codes, weights=similarities, minlength=len(owner_ids)) / counts
+            else:
+                scores = np.full(len(owner_ids), -np.inf, dtype=np.float32)
+                np.maximum.at(scores, codes, similarities)
+        best = int(np.argmax(scores))
+        return int(owner_ids[best]), float(scores[best])
+
+    def get_segments(self):
+        # owner ids, dense owner index of every row and templates per owner, rebuilt after each change
+        if self.segments is None:
+            self.segments = np.unique(self.owners[:self.size], return_inverse=True, return_counts=True)
+        return self.segments
+
+    def get_owner_centroids(self):
+        if self.owner_centroids is None:
+            owner_ids, codes, counts = self.get_segments()
+            order = np.argsort(codes, kind='stable')
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            sums = np.add.reduceat(self.matrix[:self.size][order], starts, axis=0)
+            self.owner_centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        return self.owner_centroids
+
+    def invalidate(self):
+        self.segments = None
+        self.owner_centroids = None
+        self.changes += 1
+
+    def copy(self):
+        # the copy shares the arrays and appends into their spare rows, the active rows are duplicated only when one
+        # of the galleries overwrites them. Cached segments are replaced, never modified in place, so they are shared
+        gallery = copy.copy(self)
+        gallery.rows = dict(self.rows)
+        gallery.index = None if self.index is None else self.index.copy()
+        gallery.shared_size = self.shared_size = self.size
+        self.owns_tail = False
+        return gallery
+
+    def make_writable(self, row):
+        if row < self.shared_size or (row >= self.size and not self.owns_tail):
+            self.matrix = None if self.matrix is None else self.matrix.copy()
+            self.ids = self.ids.copy()
+            self.owners = self.owners.copy()
+            self.shared_size = 0
+            self.owns_tail = True
+
+    def set_index(self, index):
+        self.index = index
+        self.check_index()
+
+    def index_added(self, template_id, vector):
+        if self.index is None:
+            return
+        if self.index.trained:
+            self.index.add(template_id, vector)
+        self.check_index()
+
+    def check_index(self):
+        if self.index is not None and self.index.needs_training(self.size):
+            self.index.train(*self.get_vectors())
+
+    def reserve(self, size):
+        capacity = len(self.ids)
+        if size <= capacity:
+            return
+        capacity = max(capacity, 1)
+        while capacity < size:
+            capacity *= 2
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        matrix[:self.size] = self.matrix[:self.size]
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:self.size] = self.ids[:self.size]
+        owners = np.empty(capacity, dtype=np.int64)
+        owners[:self.size] = self.owners[:self.size]
+        self.matrix, self.ids, self.owners = matrix, ids, owners
+        self.shared_size = 0
+        self.owns_tail = True
+
+    def normalize(self, features):
+        vector = np.asarray(features, dtype=np.float32).ravel()
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+    @staticmethod
+    def from_templates(template_ids, owners, vectors, index=None, aggregation='max'):
+        gallery = Gallery(capacity=max(len(template_ids), 64), aggregation=aggregation)
+        if len(template_ids):
+            gallery.extend(template_ids, vectors, owners)
+        gallery.set_index(index)
+        return gallery
+
+
+def centroid(templates):
+    templates = np.atleast_2d(np.asarray(templates, dtype=np.float32))
+    templates = templates / np.maximum(np.linalg.norm(templates, axis=1, keepdims=True), 1e-12)
+    mean = templates.mean(axis=0)
+    return mean / max(np.linalg.norm(mean), 1e-12)
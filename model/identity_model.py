@@ -1,6 +1,7 @@
 class Identity:
-    def __init__(self, name, surname, identity_id=0, features=None):
+    def __init__(self, name, surname, identity_id=0, features=None, templates=None):
         self.identity_id = identity_id
         self.name = name
         self.surname = surname
         self.features = features
+        self.templates = templates
@@ -0,0 +1,140 @@
+import os
+import copy
+import numpy as np
+from model.gallery import Gallery
+
+
+class IVFIndex:
+    def __init__(self, n_lists=None, n_probe=8, min_size=10_000, iterations=10, retrain_factor=4, seed=0):
+        # n_probe is the recall/latency knob: number of nearest coarse clusters scanned per query
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_size = min_size
+        self.iterations = iterations
+        self.retrain_factor = retrain_factor
+        self.seed = seed
+        self.trained = False
+        self.trained_size = 0
+        self.centroids = None
+        self.lists = list()
+        # inverted lists shared with a copy are duplicated before this index modifies them
+        self.owned_lists = set()
+        self.assignments = dict()
+
+    def __len__(self):
+        return len(self.assignments)
+
+    def needs_training(self, size):
+        if size < self.min_size:
+            return False
+        return not self.trained or size > self.trained_size * self.retrain_factor
+
+    def train(self, ids, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        n_lists = self.n_lists or int(4 * np.sqrt(len(vectors)))
+        n_lists = max(1, min(n_lists, len(vectors)))
+        self.centroids = self.kmeans(vectors, n_lists)
+        self.trained = True
+        self.trained_size = len(vectors)
+        self.lists = [Gallery(dim=vectors.shape[1], capacity=16) for _ in range(n_lists)]
+        self.owned_lists = set(range(n_lists))
+        self.assignments = dict()
+        self.extend(ids, vectors)
+
+    def kmeans(self, vectors, n_lists):
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(vectors), 64 * n_lists)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+        for i in range(self.iterations):
+            assignment = self.assign(sample, centroids)
+            order = np.argsort(assignment, kind='stable')
+            clusters, starts = np.unique(assignment[order], return_index=True)
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            empty = np.setdiff1d(np.arange(n_lists), clusters)
+            centroids[clusters] = sums
+            # re-seed clusters that lost all their points
+            centroids[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        return centroids
+
+    def assign(self, vectors, centroids=None, chunk_size=8192):
+        centroids = self.centroids if centroids is None else centroids
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            assignment[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+        return assignment
+
+    def add(self, identity_id, vector):
+        list_no = int(np.argmax(self.centroids @ vector))
+        self.get_list(list_no).add(identity_id, vector)
+        self.assignments[identity_id] = list_no
+
+    def extend(self, ids, vectors):
+        ids = np.asarray(ids)
+        assignment = self.assign(vectors)
+        for list_no in np.unique(assignment):
+            mask = assignment == list_no
+            self.get_list(list_no).extend(ids[mask], vectors[mask])
+        self.assignments.update(zip(ids.tolist(), assignment.tolist()))
+
+    def remove(self, identity_id):
+        list_no = self.assignments.pop(identity_id, None)
+        if list_no is not None:
+            self.get_list(list_no).remove(identity_id)
+
+    def search(self, vector):
+        similarities = self.centroids @ vector
+        n_probe = min(self.n_probe, len(self.lists))
+        probes = np.argpartition(-similarities, n_probe - 1)[:n_probe]
+        person, max_similarity = None, -1
+        for list_no in probes:
+            identity_id, similarity = self.lists[list_no].exact_match(vector)
+            if identity_id is not None and similarity > max_similarity:
+                person, max_similarity = identity_id, similarity
+        return person, max_similarity
+
+    def get_list(self, list_no):
+        if list_no not in self.owned_lists:
+            self.lists[list_no] = self.lists[list_no].copy()
+            self.owned_lists.add(list_no)
+        return self.lists[list_no]
+
+    def copy(self):
+        # centroids are never modified in place, inverted lists are copied once either index modifies them
+        index = copy.copy(self)
+        index.lists = list(self.lists)
+        index.owned_lists = set()
+        self.owned_lists = set()
+        index.assignments = dict(self.assignments)
+        return index
+
+    def save(self, path):
+        if not self.trained:
+            return
+        ids = np.fromiter(self.assignments.keys(), dtype=np.int64, count=len(self.assignments))
+        list_nos = np.fromiter(self.assignments.values(), dtype=np.int64, count=len(self.assignments))
+        np.savez(path, centroids=self.centroids, ids=ids, list_nos=list_nos, trained_size=self.trained_size)
+
+    def load(self, path, gallery):
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as data:
+            centroids, ids, list_nos = data['centroids'], data['ids'], data['list_nos']
+            trained_size = int(data['trained_size'])
+        # the persisted assignments are only usable if they describe exactly the current gallery
+        gallery_ids, vectors = gallery.get_vectors()
+        if centroids.shape[1] != gallery.dim or len(ids) != len(gallery_ids) or set(ids.tolist()) != gallery.rows.keys():
+            return False
+        self.centroids = centroids
+        self.trained = True
+        self.trained_size = trained_size
+        self.lists = [Gallery(dim=centroids.shape[1], capacity=16) for _ in range(len(centroids))]
+        self.owned_lists = set(range(len(centroids)))
+        rows = np.fromiter((gallery.rows[i] for i in ids.tolist()), dtype=np.int64, count=len(ids))
+        for list_no in np.unique(list_nos):
+            mask = list_nos == list_no
+            self.lists[list_no].extend(ids[mask], vectors[rows[mask]])
+        self.assignments = dict(zip(ids.tolist(), list_nos.tolist()))
+        return True
@@ -0,0 +1,31 @@
+import argparse
+import datetime
+
+from utils.zipfile_data_generator import DataHolder
+from utils.packed_data_generator import pack_dataset
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--zipfiles', default='', type=str, help='comma separated list of zipfiles containing aligned faces')
+parser.add_argument('--output_dir', default='', type=str, help='directory to write packed shards and label index')
+parser.add_argument('--shard_size', default=100_000, type=int, help='number of images per shard')
+parser.add_argument('--image_size', default=144, type=int, help='side of packed images, crops are taken during training')
+
+
+def main():
+    global args
+    args = parser.parse_args()
+
+    zipfiles = [x for x in args.zipfiles.split(',') if x]
+    if len(zipfiles) < 1:
+        raise ValueError('Please specify at least one zipfile')
+    if not args.output_dir:
+        raise ValueError('Please specify output directory')
+
+    start = datetime.datetime.now()
+    holder = DataHolder(zipfiles)
+    pack_dataset(holder, args.output_dir, shard_size=args.shard_size, image_size=(args.image_size, args.image_size))
+    print('TOTAL TIME: {}'.format(datetime.datetime.now() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,61 +1,169 @@
 import dlib
 import io
 import os
+import glob
+import shutil
 import argparse
 import datetime
 import zipfile
-import matplotlib.image
+import multiprocessing
 import numpy as np
 from PIL import Image
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--zipfiles', default='', type=str, help='comma separated list of zipfiles containing face dataset')
+parser.add_argument('--num_workers', default=os.cpu_count(), type=int, help='number of aligning processes')
+parser.add_argument('--chunk_size', default=1000, type=int, help='number of images aligned per task and checkpoint')
+parser.add_argument('--upsample', default=1, type=int, help='number of times images are upsampled before detection')
+parser.add_argument('--detection_scale', default=1.0, type=float,
+                    help='scale of images used for detection, landmarks are always found at full resolution')
+parser.add_argument('--detection_batch_size', default=16, type=int, help='number of same-size images detected at once')
 
 detector = dlib.cnn_face_detection_model_v1('resources/mmod_human_face_detector.dat')
 sp = dlib.shape_predictor('resources/shape_predictor_5_face_landmarks.dat')
+read_zf = None
+detect_options = dict()
 
 
 def main():
     global args
     args = parser.parse_args()
 
-    zipfiles = [x for x in args.zipfiles.split(',')]
+    zipfiles = [x for x in args.zipfiles.split(',') if x]
     if len(zipfiles) < 1:
         raise ValueError('Please specify at least one zipfile')
 
-    i = 0
-    temp_path = os.path.join(os.getcwd(), 'temp.jpg')
-    global_t, t = datetime.datetime.now(), datetime.datetime.now()
-
+    global_t = datetime.datetime.now()
     for zf in zipfiles:
-        index = zf.rfind('.')
-        new_zf = zf[:index] + '-aligned' + zf[index:]
-        with zipfile.ZipFile(zf, 'r') as read_zf, zipfile.ZipFile(new_zf, 'a') as write_zf:
-            for filename in read_zf.namelist():
-                imgdata = read_zf.read(filename)
-                image = np.array(Image.open(io.BytesIO(imgdata)))
-                aligned = align_face(image)
-                matplotlib.image.imsave(temp_path, aligned)
-                write_zf.write(temp_path, arcname=filename)
-
-                i += 1
-                if i % 50_000 == 0:
-                    print('Aligned {} faces'.format(i))
-                    print('Time elapsed: {}'.format(datetime.datetime.now() - t))
-                    t = datetime.datetime.now()
-
+        align_zipfile(zf, args.num_workers, args.chunk_size, dict(upsample=args.upsample,
+                                                                  detection_scale=args.detection_scale,
+                                                                  batch_size=args.detection_batch_size))
         print('TOTAL TIME: {}'.format(datetime.datetime.now() - global_t))
 
 
-def align_face(image, crop_size=144):
-    dets = detector(image, 1)
+def align_zipfile(zf, num_workers, chunk_size, options):
+    index = zf.rfind('.')
+    new_zf = zf[:index] + '-aligned' + zf[index:]
+    # every finished chunk is stored as its own part zip, so a crashed run continues where it stopped
+    parts_dir = new_zf + '.parts'
+    os.makedirs(parts_dir, exist_ok=True)
+    parts = sorted(glob.glob(os.path.join(parts_dir, 'part-*.zip')))
+    done = set()
+    for part in parts + ([new_zf] if os.path.exists(new_zf) else []):
+        with zipfile.ZipFile(part, 'r') as part_zf:
+            done.update(part_zf.namelist())
+
+    with zipfile.ZipFile(zf, 'r') as source_zf:
+        filenames = [name for name in source_zf.namelist() if not name.endswith('/') and name not in done]
+    chunks = [filenames[i:i + chunk_size] for i in range(0, len(filenames), chunk_size)]
+    print('{}: {} faces already aligned, {} remaining'.format(zf, len(done), len(filenames)))
+
+    i, detected, t = 0, 0, datetime.datetime.now()
+    pool = None
+    if num_workers > 1:
+        pool = multiprocessing.Pool(num_workers, initializer=init_worker, initargs=(zf, options))
+    else:
+        init_worker(zf, options)
+    try:
+        results = pool.imap_unordered(align_chunk, chunks) if pool is not None else map(align_chunk, chunks)
+        # workers only align and encode, this process is the single writer of all output files
+        for part_no, (aligned, chunk_detected) in enumerate(results, len(parts)):
+            write_part(os.path.join(parts_dir, 'part-{:06d}.zip'.format(part_no)), aligned)
+            i += len(aligned)
+            detected += chunk_detected
+            if i // 50_000 != (i - len(aligned)) // 50_000:
+                print('Aligned {} faces'.format(i))
+                print('Time elapsed: {}'.format(datetime.datetime.now() - t))
+                t = datetime.datetime.now()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # images without a detected face are only resized, so the retention rate shows what detection settings cost
+    if i > 0:
+        print('Retention rate: {:.2f} % ({} of {} faces detected)'.format(detected * 100 / i, detected, i))
+    merge_parts(new_zf, parts_dir)
+
+
+def init_worker(zf, options):
+    global read_zf, detect_options
+    read_zf = zipfile.ZipFile(zf, 'r')
+    detect_options = options
+
+
+def align_chunk(filenames):
+    images = [np.array(Image.open(io.BytesIO(read_zf.read(filename)))) for filename in filenames]
+    dets = detect_faces(images, **detect_options)
+    aligned = [(filename, encode_image(align_face(image, dets=image_dets)))
+               for filename, image, image_dets in zip(filenames, images, dets)]
+    return aligned, sum(1 for image_dets in dets if image_dets)
+
+
+def encode_image(image):
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def write_part(path, aligned):
+    # the part only becomes visible once it is complete
+    with zipfile.ZipFile(path + '.tmp', 'w') as part_zf:
+        for filename, data in aligned:
+            part_zf.writestr(filename, data)
+    os.replace(path + '.tmp', path)
+
+
+def merge_parts(new_zf, parts_dir):
+    parts = sorted(glob.glob(os.path.join(parts_dir, 'part-*.zip')))
+    if parts:
+        written = set()
+        with zipfile.ZipFile(new_zf + '.tmp', 'w') as write_zf:
+            for path in ([new_zf] if os.path.exists(new_zf) else []) + parts:
+                with zipfile.ZipFile(path, 'r') as part_zf:
+                    # a run interrupted after the merge but before the cleanup must not duplicate entries
+                    for info in part_zf.infolist():
+                        if info.filename not in written:
+                            write_zf.writestr(info, part_zf.read(info))
+                            written.add(info.filename)
+        os.replace(new_zf + '.tmp', new_zf)
+    shutil.rmtree(parts_dir)
+
+
+def detect_faces(images, upsample=1, detection_scale=1.0, batch_size=16):
+    # dlib only runs images of identical size in one batch, so images are grouped by their shape
+    groups = dict()
+    for i, image in enumerate(images):
+        if image.ndim == 2:
+            image = np.dstack([image] * 3)
+        if detection_scale != 1.0:
+            image = dlib.resize_image(image, int(image.shape[0] * detection_scale),
+                                      int(image.shape[1] * detection_scale))
+        groups.setdefault(image.shape, list()).append((i, image))
+
+    dets = [None] * len(images)
+    for group in groups.values():
+        indices, scaled = zip(*group)
+        for i, image_dets in zip(indices, detector(list(scaled), upsample, batch_size=batch_size)):
+            # rectangles are mapped back, so landmarks are predicted on the full resolution image
+            dets[i] = [(scale_rect(det.rect, 1 / detection_scale), det.confidence) for det in image_dets]
+    return dets
+
+
+def scale_rect(rect, scale):
+    if scale == 1.0:
+        return rect
+    return dlib.rectangle(int(rect.left() * scale), int(rect.top() * scale),
+                          int(rect.right() * scale), int(rect.bottom() * scale))
+
+
+def align_face(image, crop_size=144, dets=None):
+    if dets is None:
+        dets = detect_faces([image])[0]
     if len(dets) < 1:
         return dlib.resize_image(image, crop_size, crop_size)
-    max_confidence = 0
-    for det in dets:
-        if det.confidence > max_confidence:
-            face = sp(image, det.rect)
-            max_confidence = det.confidence
+    rect, confidence = max(dets, key=lambda det: det[1])
+    face = sp(image, rect)
     return dlib.get_face_chip(image, face, crop_size)
 
 
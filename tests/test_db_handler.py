@@ -0,0 +1,218 @@
+import sqlite3
+import numpy as np
+import pytest
+from model.db_handler import DBHandler, Singleton
+from model.gallery import Gallery
+from model.identity_model import Identity
+
+DIM = 8
+
+
+def create_schema(path):
+    # the schema created by the original application, features stored as text
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE identities (identity_id integer not null constraint identities_pk primary key '
+                       'autoincrement, name text not null, surname text not null, feature_vector text not null)')
+    return connection
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'identitydb')
+    connection = create_schema(path)
+    rng = np.random.default_rng(0)
+    for i, vector in enumerate(rng.standard_normal((3, DIM)).astype(np.float32)):
+        connection.execute('INSERT INTO identities (name, surname, feature_vector) VALUES (?,?,?)',
+                           ('name{}'.format(i), 'surname{}'.format(i), ','.join(map(str, vector))))
+    connection.commit()
+    connection.close()
+    return path
+
+
+@pytest.fixture
+def handler(db_path):
+    handler = DBHandler._cls(db_path=db_path, use_index=False)
+    yield handler
+    handler.close()
+
+
+def reloaded(handler):
+    identities, (template_ids, owners, matrix) = handler.read_identities()
+    return identities, sorted(zip(template_ids.tolist(), owners.tolist()))
+
+
+def gallery_state(handler):
+    gallery = handler.get_gallery()
+    return sorted(zip(gallery.get_vectors()[0].tolist(), gallery.get_owners().tolist()))
+
+
+def test_migration_converts_text_features(handler):
+    assert len(handler.get_identities()) == 3
+    assert len(handler.get_gallery()) == 3
+    identity = handler.get_identities()[1]
+    assert identity.templates.shape == (1, DIM)
+    assert handler.get_gallery().match(identity.templates[0]) == (1, pytest.approx(1))
+
+
+def test_add_identities_writes_templates(handler):
+    rng = np.random.default_rng(1)
+    templates = rng.standard_normal((2, DIM))
+    identity = Identity('new', 'person', templates=templates)
+    handler.add_identities([identity])
+
+    assert identity.identity_id in handler.get_identities()
+    assert handler.get_gallery().match(templates[1])[0] == identity.identity_id
+    identities, templates_in_db = reloaded(handler)
+    assert identities[identity.identity_id].templates.shape == (2, DIM)
+    assert templates_in_db == gallery_state(handler)
+
+
+def test_add_templates_extends_identity(handler):
+    handler.add_templates(1, np.ones((2, DIM)))
+    assert handler.get_identities()[1].templates.shape == (3, DIM)
+    assert handler.get_gallery().match(np.ones(DIM))[0] == 1
+    assert reloaded(handler)[1] == gallery_state(handler)
+
+
+def test_edit_identity_without_features_keeps_templates(handler):
+    handler.edit_identity(Identity('renamed', 'person', identity_id=2))
+    identity = handler.get_identities()[2]
+    assert identity.name == 'renamed'
+    assert identity.templates.shape == (1, DIM)
+    assert reloaded(handler)[1] == gallery_state(handler)
+
+
+def test_edit_identity_with_features_replaces_templates(handler):
+    handler.add_templates(2, np.ones((2, DIM)))
+    handler.edit_identity(Identity('name1', 'surname1', identity_id=2, features=-np.ones(DIM)))
+    assert handler.get_identities()[2].templates.shape == (1, DIM)
+    assert handler.get_gallery().match(-np.ones(DIM)) == (2, pytest.approx(1))
+    assert reloaded(handler)[1] == gallery_state(handler)
+
+
+def test_delete_identity(handler):
+    handler.delete_identity(3)
+    assert 3 not in handler.get_identities()
+    assert 3 not in handler.get_gallery().get_owners()
+    assert reloaded(handler)[1] == gallery_state(handler)
+
+
+def test_failed_edit_leaves_database_and_gallery_consistent(handler):
+    before = gallery_state(handler)
+    with pytest.raises(ValueError):
+        handler.edit_identity(Identity('name0', 'surname0', identity_id=1, features=np.ones(DIM + 1)))
+    assert gallery_state(handler) == before
+    assert reloaded(handler)[1] == before
+    assert handler.get_identities()[1].name == 'name0'
+
+
+def test_unknown_identity_fails_only_its_request(handler):
+    rng = np.random.default_rng(2)
+    identity = Identity('other', 'person', features=rng.standard_normal(DIM))
+    futures = [handler.submit_write(handler.write_delete, 99),
+               handler.submit_write(handler.write_add, [identity])]
+    with pytest.raises(KeyError):
+        futures[0].result(timeout=5)
+    assert futures[1].result(timeout=5) == [identity.identity_id]
+    assert reloaded(handler)[1] == gallery_state(handler)
+
+
+def test_partially_applied_request_reloads_state(handler, monkeypatch):
+    def failing_extend(self, *args, **kwargs):
+        raise RuntimeError('extend failed')
+
+    rng = np.random.default_rng(3)
+    handler.add_templates(1, rng.standard_normal((1, DIM)))
+    before = gallery_state(handler)
+    monkeypatch.setattr(Gallery, 'extend', failing_extend)
+    with pytest.raises(RuntimeError):
+        # templates of the identity are removed from the gallery before the failing extend
+        handler.edit_identity(Identity('name0', 'surname0', identity_id=1, features=np.ones(DIM)))
+    monkeypatch.undo()
+    assert gallery_state(handler) == before
+    assert reloaded(handler)[1] == before
+
+
+def test_writer_survives_unexpected_errors(handler, monkeypatch):
+    def failing_copy(self):
+        raise MemoryError('copy failed')
+
+    monkeypatch.setattr(Gallery, 'copy', failing_copy)
+    with pytest.raises(MemoryError):
+        handler.delete_identity(1)
+    monkeypatch.undo()
+    assert handler.writer.is_alive()
+    handler.delete_identity(1)
+    assert 1 not in handler.get_identities()
+
+
+def test_aggregation_is_kept_by_written_galleries(db_path):
+    handler = DBHandler._cls(db_path=db_path, use_index=False, aggregation='mean')
+    try:
+        handler.add_templates(1, [np.ones(DIM), -np.ones(DIM)])
+        gallery = handler.get_gallery()
+        assert gallery.aggregation == 'mean'
+        owner_ids, codes, counts = gallery.get_segments()
+        assert counts[owner_ids.tolist().index(1)] == 3
+    finally:
+        handler.close()
+
+
+def test_snapshot_is_reused_after_close(db_path):
+    handler = DBHandler._cls(db_path=db_path, use_index=False)
+    handler.add_templates(1, np.ones((1, DIM)))
+    before = gallery_state(handler)
+    handler.close()
+
+    handler = DBHandler._cls(db_path=db_path, use_index=False)
+    try:
+        assert isinstance(handler.get_gallery().get_vectors()[1], np.ndarray)
+        assert gallery_state(handler) == before
+        assert handler.get_identities()[1].templates.shape == (2, DIM)
+    finally:
+        handler.close()
+
+
+def test_empty_database_opens_and_closes(tmp_path):
+    path = str(tmp_path / 'identitydb')
+    create_schema(path).close()
+    handler = DBHandler._cls(db_path=path)
+    assert len(handler.get_gallery()) == 0
+    assert handler.get_gallery().match(np.ones(DIM)) == (None, -1)
+    handler.close()
+
+    handler = DBHandler._cls(db_path=path)
+    try:
+        handler.add_identity(Identity('first', 'person', features=np.ones(DIM)))
+        assert handler.get_gallery().match(np.ones(DIM))[0] == 1
+    finally:
+        handler.close()
+
+
+def test_singleton_is_configured_on_creation():
+    class Settings:
+        def __init__(self, aggregation='max', index_probes=8):
+            self.aggregation = aggregation
+            self.index_probes = index_probes
+
+    singleton = Singleton(Settings)
+    instance = singleton.get_instance(aggregation='mean')
+    assert instance.aggregation == 'mean'
+    assert singleton.get_instance() is instance
+    assert singleton.get_instance(aggregation='mean', index_probes=8) is instance
+    with pytest.raises(ValueError):
+        singleton.get_instance(index_probes=16)
+
+
+def test_config_recreates_equivalent_handler(db_path):
+    handler = DBHandler._cls(db_path=db_path, use_index=False, index_probes=16, aggregation='centroid')
+    try:
+        config = handler.get_config()
+    finally:
+        handler.close()
+    handler = DBHandler._cls(**config)
+    try:
+        assert handler.get_config() == config
+        assert handler.get_gallery().aggregation == 'centroid'
+    finally:
+        handler.close()
@@ -0,0 +1,131 @@
+import numpy as np
+import pytest
+from model.gallery import Gallery, centroid
+from model.ivf_index import IVFIndex
+
+
+def normalized(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+@pytest.fixture
+def templates():
+    # owner 10 has two templates pointing in opposite directions, owner 20 one template close to the query
+    return [1, 2, 3], [10, 10, 20], np.array([[1, 0, 0], [-1, 0, 0], [0.8, 0.6, 0]], dtype=np.float32)
+
+
+def test_match_returns_owner_of_best_template(templates):
+    gallery = Gallery.from_templates(*templates)
+    owner, similarity = gallery.match([1, 0, 0])
+    assert owner == 10
+    assert similarity == pytest.approx(1)
+
+
+def test_mean_aggregation_averages_template_similarities(templates):
+    gallery = Gallery.from_templates(*templates, aggregation='mean')
+    owner, similarity = gallery.match([1, 0, 0])
+    assert owner == 20
+    assert similarity == pytest.approx(0.8)
+
+
+def test_centroid_aggregation_matches_owner_centroids():
+    gallery = Gallery.from_templates([1, 2, 3], [10, 10, 20], [[1, 0, 0], [0, 1, 0], [1, 0.1, 0]],
+                                     aggregation='centroid')
+    owner, similarity = gallery.match([1, 1, 0])
+    assert owner == 10
+    assert similarity == pytest.approx(1, abs=1e-6)
+    np.testing.assert_allclose(gallery.get_owner_centroids()[0], centroid([[1, 0, 0], [0, 1, 0]]), atol=1e-6)
+
+
+def test_invalid_aggregation_is_rejected():
+    with pytest.raises(ValueError):
+        Gallery(aggregation='median')
+
+
+def test_empty_gallery_has_no_match():
+    gallery = Gallery()
+    assert gallery.match([1, 0]) == (None, -1)
+    template_ids, matrix = gallery.get_vectors()
+    assert len(template_ids) == 0 and matrix.shape == (0, 0)
+
+
+def test_remove_keeps_rows_contiguous(templates):
+    gallery = Gallery.from_templates(*templates)
+    gallery.remove(1)
+    assert len(gallery) == 2
+    assert set(gallery.get_vectors()[0].tolist()) == {2, 3}
+    np.testing.assert_allclose(gallery.get_vector(3), normalized([0.8, 0.6, 0]))
+    assert gallery.match([1, 0, 0])[0] == 20
+
+
+def test_remove_owner_drops_all_its_templates(templates):
+    gallery = Gallery.from_templates(*templates)
+    gallery.remove_owner(10)
+    assert len(gallery) == 1
+    assert gallery.get_owners().tolist() == [20]
+
+
+def test_update_and_add_grow_and_change_rows():
+    gallery = Gallery(capacity=1)
+    gallery.add(1, [1, 0])
+    gallery.add(2, [0, 1], owner=7)
+    gallery.add(1, [0, -1])
+    assert len(gallery) == 2
+    assert gallery.get_owner(2) == 7
+    assert gallery.match([0, -1]) == (1, pytest.approx(1))
+
+
+def test_copy_does_not_change_original(templates):
+    gallery = Gallery.from_templates(*templates)
+    copy = gallery.copy()
+    copy.extend([4], [[0, 0, 1]], [30])
+    copy.update(3, [0, 1, 0])
+    copy.remove_owner(10)
+
+    assert len(gallery) == 3
+    assert 4 not in gallery
+    np.testing.assert_allclose(gallery.get_vector(3), normalized([0.8, 0.6, 0]))
+    assert gallery.match([1, 0, 0])[0] == 10
+    assert sorted(copy.get_vectors()[0].tolist()) == [3, 4]
+    assert copy.match([0, 0, 1])[0] == 30
+
+
+def test_copies_appending_to_shared_arrays_do_not_overwrite_each_other(templates):
+    gallery = Gallery.from_templates(*templates)
+    first = gallery.copy()
+    second = gallery.copy()
+    first.add(4, [0, 0, 1], owner=40)
+    second.add(5, [0, 1, 0], owner=50)
+    gallery.add(6, [0, -1, 0], owner=60)
+
+    assert first.match([0, 0, 1])[0] == 40
+    assert second.match([0, 1, 0])[0] == 50
+    assert gallery.match([0, -1, 0])[0] == 60
+    assert 5 not in first and 4 not in second
+
+
+def test_index_match_agrees_with_exact_search():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((600, 16))
+    gallery = Gallery.from_templates(np.arange(600), np.arange(600) // 3, vectors,
+                                     index=IVFIndex(n_lists=8, n_probe=8, min_size=100))
+    assert gallery.index.trained
+    for template_id in (0, 250, 599):
+        owner, similarity = gallery.match(vectors[template_id])
+        assert owner == template_id // 3
+        assert similarity == pytest.approx(1, abs=1e-5)
+
+
+def test_index_copy_leaves_original_lists_untouched():
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((200, 8))
+    gallery = Gallery.from_templates(np.arange(200), np.arange(200), vectors,
+                                     index=IVFIndex(n_lists=4, n_probe=4, min_size=100))
+    copy = gallery.copy()
+    copy.remove(10)
+    copy.add(1000, vectors[10], owner=1000)
+
+    assert len(gallery.index) == 200
+    assert gallery.match(vectors[10])[0] == 10
+    assert copy.match(vectors[10])[0] == 1000
@@ -0,0 +1,88 @@
+import threading
+from queue import Empty
+from types import SimpleNamespace
+import pytest
+from controller.request_queue import RecognitionQueue
+
+
+def make_face(face_id, size=10):
+    return SimpleNamespace(face_id=face_id, coordinates=(0, 0, size, size))
+
+
+def drain(queue):
+    faces = list()
+    while True:
+        try:
+            faces.append(queue.get_nowait())
+        except Empty:
+            return faces
+
+
+def test_invalid_policy_is_rejected():
+    with pytest.raises(ValueError):
+        RecognitionQueue(policy='drop_all')
+
+
+def test_drop_oldest_returns_evicted_face():
+    queue = RecognitionQueue(maxsize=2)
+    a, b, c = make_face('a'), make_face('b'), make_face('c')
+    assert queue.put(a) == []
+    assert queue.put(b) == []
+    assert queue.put(c) == [a]
+    assert drain(queue) == [b, c]
+
+
+def test_drop_newest_rejects_incoming_face():
+    queue = RecognitionQueue(maxsize=1, policy='drop_newest')
+    a, b = make_face('a'), make_face('b')
+    queue.put(a)
+    assert queue.put(b) == [b]
+    assert drain(queue) == [a]
+
+
+def test_coalesce_keeps_one_request_per_track():
+    queue = RecognitionQueue(maxsize=2, policy='coalesce')
+    old, other, new = make_face('a'), make_face('b'), make_face('a')
+    queue.put(old)
+    queue.put(other)
+    assert queue.put(new) == [old]
+    assert drain(queue) == [new, other]
+
+
+def test_replace_swaps_queued_crop():
+    queue = RecognitionQueue(policy='coalesce')
+    old, new = make_face('a'), make_face('a')
+    queue.put(old)
+    assert queue.replace(new)
+    assert not queue.replace(make_face('b'))
+    assert drain(queue) == [new]
+
+
+def test_priority_serves_largest_faces_first():
+    queue = RecognitionQueue(maxsize=2, policy='priority')
+    small, large, medium = make_face('s', 5), make_face('l', 50), make_face('m', 20)
+    queue.put(small)
+    queue.put(large)
+    assert queue.put(medium) == [small]
+    assert queue.put(make_face('t', 1))[0].face_id == 't'
+    assert drain(queue) == [large, medium]
+
+
+def test_sentinel_is_returned_after_queued_faces():
+    queue = RecognitionQueue()
+    face = make_face('a')
+    queue.put(face)
+    queue.put(None)
+    assert queue.get() is face
+    assert queue.get() is None
+
+
+def test_get_times_out_and_wakes_up_on_put():
+    queue = RecognitionQueue()
+    with pytest.raises(Empty):
+        queue.get(timeout=0.01)
+    face = make_face('a')
+    timer = threading.Timer(0.05, queue.put, args=(face,))
+    timer.start()
+    assert queue.get(timeout=5) is face
+    timer.join()
@@ -0,0 +1,86 @@
+import time
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+
+from controller.track_memory import TrackMemory
+from model import face_model as fm
+from model.identity_model import Identity
+
+
+def make_face(face_id, coordinates=(0, 0, 10, 10), identity=None, state=fm.PROCESSING):
+    return fm.Face(None, coordinates, face_id=face_id, identity=identity, state=state)
+
+
+def same_face(face_a, face_b):
+    return 1.0
+
+
+def other_face(face_a, face_b):
+    return 0.0
+
+
+@pytest.fixture
+def identity():
+    return Identity('name', 'surname', identity_id=1)
+
+
+def test_released_track_is_recalled_near_its_last_box(identity):
+    memory = TrackMemory()
+    face = make_face('a', identity=identity, state=fm.RECOGNIZED)
+    memory.remember(face, np.ones(4))
+    memory.release(face)
+
+    assert memory.recall(make_face('b', (50, 50, 10, 10)), same_face, 0.5) is None
+    assert memory.recall(make_face('b'), other_face, 0.5) is None
+    entry = memory.recall(make_face('b', (2, 2, 10, 10)), same_face, 0.5)
+    assert entry.face_id == 'a'
+    assert entry.identity is identity
+    # an active entry cannot be recalled by another detection
+    assert memory.recall(make_face('c'), same_face, 0.5) is None
+
+
+def test_confirm_counts_down_votes(identity):
+    memory = TrackMemory(confirm_votes=2)
+    face = make_face('a', identity=identity, state=fm.RECOGNIZED)
+    memory.remember(face, np.ones(4))
+    face.votes_needed = memory.confirm_votes
+    assert memory.confirm(face, same_face, 0.5)
+    assert face.votes_needed == 1
+    assert not memory.confirm(face, other_face, 0.5)
+    assert face.votes_needed == 1
+
+
+def test_match_embedding_uses_current_identities(identity):
+    memory = TrackMemory(embedding_threshold=0.6)
+    memory.remember(make_face('a', identity=identity, state=fm.RECOGNIZED), np.ones(4))
+    renamed = Identity('renamed', 'surname', identity_id=1)
+
+    assert memory.match_embedding(np.ones(4), {1: renamed}) == (renamed, pytest.approx(1))
+    assert memory.match_embedding(-np.ones(4), {1: renamed}) == (None, -1)
+    # deleted identities are never returned
+    assert memory.match_embedding(np.ones(4), {}) == (None, -1)
+
+
+def test_expired_entries_are_evicted(identity):
+    memory = TrackMemory(ttl=10.0, max_age=60.0)
+    lost = make_face('lost', identity=identity, state=fm.RECOGNIZED)
+    active = make_face('active', identity=identity, state=fm.RECOGNIZED)
+    memory.remember(lost, np.ones(4))
+    memory.remember(active, np.ones(4))
+    memory.release(lost)
+    memory.entries['lost'].last_seen = time.monotonic() - 11
+    memory.evict_expired()
+    assert list(memory.entries) == ['active']
+
+    memory.entries['active'].remembered_at = time.monotonic() - 61
+    assert memory.match_embedding(np.ones(4), {1: identity}) == (None, -1)
+    assert len(memory) == 0
+
+
+def test_capacity_drops_least_recently_used(identity):
+    memory = TrackMemory(capacity=2)
+    for face_id in 'abc':
+        memory.remember(make_face(face_id, identity=identity, state=fm.RECOGNIZED), np.ones(4))
+    assert list(memory.entries) == ['b', 'c']
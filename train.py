@@ -2,10 +2,15 @@ import argparse
 from keras.callbacks import LearningRateScheduler, ModelCheckpoint, TerminateOnNaN, CSVLogger
 
 from utils.zipfile_data_generator import DataHolder, DataGenerator
+from utils.packed_data_generator import PackedDataGenerator
+from utils.prefetcher import PrefetchingGenerator, InputWaitLogger
 from cnn import cnn_model as cm
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--zipfiles', default='', type=str, help='comma separated list of zipfiles containing face dataset')
+parser.add_argument('--packed_dir', default='', type=str, help='directory with dataset packed by pack.py, used instead of zipfiles')
+parser.add_argument('--prefetch_workers', default=0, type=int, help='number of processes preparing batches, 0 disables prefetching')
+parser.add_argument('--prefetch', default=4, type=int, help='number of batches prepared ahead of the trainer')
 parser.add_argument('--epochs', default=80, type=int, help='number of total epochs to run')
 parser.add_argument('--init_epoch', default=0, type=int, help='initial epoch number')
 parser.add_argument('--batch_size', default=128, type=int, help='mini-batch size')
@@ -24,13 +29,17 @@ def main():
     global args
     args = parser.parse_args()
 
-    zipfiles = [x for x in args.zipfiles.split(',')]
-    if len(zipfiles) < 1:
-        raise ValueError('Please specify at least one zipfile')
+    if args.packed_dir:
+        train_gen = PackedDataGenerator(subset='training', packed_dir=args.packed_dir)
+        val_gen = PackedDataGenerator(subset='validation', packed_dir=args.packed_dir)
+    else:
+        zipfiles = [x for x in args.zipfiles.split(',')]
+        if len(zipfiles) < 1:
+            raise ValueError('Please specify at least one zipfile')
 
-    holder = DataHolder(zipfiles)
-    train_gen = DataGenerator(subset='training', data_holder=holder)
-    val_gen = DataGenerator(subset='validation', data_holder=holder)
+        holder = DataHolder(zipfiles)
+        train_gen = DataGenerator(subset='training', data_holder=holder)
+        val_gen = DataGenerator(subset='validation', data_holder=holder)
     x, y = train_gen.__getitem__(0)
 
     model = cm.get_model(weights_path=args.load_path,
@@ -41,6 +50,11 @@ def main():
                          weight_decay_fc2=args.weight_decay_fc2)
 
     callbacks = []
+    if args.prefetch_workers > 0:
+        train_gen = PrefetchingGenerator(train_gen, num_workers=args.prefetch_workers, prefetch=args.prefetch)
+        val_gen = PrefetchingGenerator(val_gen, num_workers=args.prefetch_workers, prefetch=args.prefetch)
+        # must run before CSVLogger, which then logs the input wait of every epoch
+        callbacks.append(InputWaitLogger(train_gen))
     callbacks.append(LearningRateScheduler(lr_schedule))
     if args.save_path:
         callbacks.append(ModelCheckpoint(args.save_path, save_weights_only=True))
@@ -49,7 +63,15 @@ def main():
     callbacks.append(TerminateOnNaN())
 
     model.compile_model(actual_lr=args.actual_lr, momentum=args.momentum)
-    model.train_model(train_gen, val_gen, args.epochs, callbacks, args.init_epoch)
+    if args.prefetch_workers > 0:
+        # batches must be requested in order from the main thread, the prefetcher runs ahead of it
+        try:
+            model.train_model(train_gen, val_gen, args.epochs, callbacks, args.init_epoch, workers=0, shuffle=False)
+        finally:
+            train_gen.close()
+            val_gen.close()
+    else:
+        model.train_model(train_gen, val_gen, args.epochs, callbacks, args.init_epoch)
 
 
 def lr_schedule(epoch, lr):
@@ -0,0 +1,124 @@
+import io
+import os
+import random
+import cv2
+import numpy as np
+from PIL import Image
+from keras.utils import Sequence, to_categorical
+
+INDEX_FILE = 'index.npz'
+
+
+def shard_path(packed_dir, shard_no):
+    return os.path.join(packed_dir, 'shard-{:05d}.npy'.format(shard_no))
+
+
+def pack_dataset(data_holder, packed_dir, shard_size=100_000, image_size=(144, 144)):
+    # decodes every image once into fixed-shape uint8 grayscale shards, labels and subsets go to a separate index
+    os.makedirs(packed_dir, exist_ok=True)
+    num_files = data_holder.get_file_num()
+    labels = data_holder.labels.astype(np.int32)
+    validation = np.zeros(num_files, dtype=bool)
+    validation[data_holder.get_files('validation')] = True
+
+    for shard_no, start in enumerate(range(0, num_files, shard_size)):
+        shard_files = range(start, min(start + shard_size, num_files))
+        shard = np.lib.format.open_memmap(shard_path(packed_dir, shard_no) + '.tmp', mode='w+', dtype=np.uint8,
+                                          shape=(len(shard_files),) + image_size)
+        for i, file_no in enumerate(shard_files):
+            shard[i] = decode_image(data_holder.read_file(file_no), image_size)
+        shard.flush()
+        del shard
+        os.replace(shard_path(packed_dir, shard_no) + '.tmp', shard_path(packed_dir, shard_no))
+        print('Packed {} of {} files'.format(shard_files.stop, num_files))
+
+    np.savez(os.path.join(packed_dir, INDEX_FILE), labels=labels, validation=validation,
+             class_num=data_holder.get_class_num(), shard_size=shard_size, image_size=image_size)
+
+
+def decode_image(imgdata, image_size):
+    image = np.array(Image.open(io.BytesIO(imgdata)))
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    if image.shape != tuple(image_size):
+        image = cv2.resize(image, (image_size[1], image_size[0]), interpolation=cv2.INTER_AREA)
+    return image
+
+
+class PackedDataGenerator(Sequence):
+    def __init__(self, subset, packed_dir, batch_size=128, crop_size=(128, 128)):
+        if subset not in ['training', 'validation']:
+            raise ValueError('Invalid subset name: {}'.format(subset))
+
+        self.subset = subset
+        self.packed_dir = packed_dir
+        self.batch_size = batch_size
+        self.crop_size = crop_size
+        self.input_shape = tuple(crop_size) + (1,)
+        with np.load(os.path.join(packed_dir, INDEX_FILE)) as index:
+            self.labels = index['labels']
+            self.num_classes = int(index['class_num'])
+            self.shard_size = int(index['shard_size'])
+            mask = index['validation'] if subset == 'validation' else ~index['validation']
+        self.shards = self.open_shards()
+        self.indices = np.flatnonzero(mask)
+        np.random.shuffle(self.indices)
+        print('{} subset length: {}'.format(self.subset, len(self.indices)))
+
+    def __getstate__(self):
+        # mapped shards would be pickled with all their data, processes receiving a copy map them again
+        state = self.__dict__.copy()
+        del state['shards']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shards = self.open_shards()
+
+    def __getitem__(self, idx):
+        indices = self.batch_items(idx)
+        batch_x = np.empty((len(indices),) + self.input_shape, dtype=np.float32)
+        batch_y = self.load_batch(indices, batch_x)
+        return batch_x, to_categorical(batch_y, self.num_classes)
+
+    def batch_items(self, idx):
+        # sorted indices keep reads from the mapped shards as sequential as possible
+        return np.sort(self.indices[idx * self.batch_size:(idx + 1) * self.batch_size])
+
+    def load_batch(self, indices, batch_x):
+        images = self.crop_images(self.read_images(indices))
+        if self.subset == 'training':
+            flip = np.random.rand(len(indices)) < 0.5
+            images[flip] = images[flip, :, ::-1]
+        batch_x[:len(indices), ..., 0] = images
+        batch_x[:len(indices)] /= 255
+        return self.labels[indices]
+
+    def open_shards(self):
+        num_shards = (len(self.labels) + self.shard_size - 1) // self.shard_size
+        return [np.load(shard_path(self.packed_dir, shard_no), mmap_mode='r') for shard_no in range(num_shards)]
+
+    def __len__(self):
+        return len(self.indices) // self.batch_size
+
+    def on_epoch_end(self):
+        np.random.shuffle(self.indices)
+
+    def read_images(self, indices):
+        shard_nos = indices // self.shard_size
+        images = np.empty((len(indices),) + self.shards[0].shape[1:], dtype=np.uint8)
+        for shard_no in np.unique(shard_nos):
+            mask = shard_nos == shard_no
+            images[mask] = self.shards[shard_no][indices[mask] % self.shard_size]
+        return images
+
+    def crop_images(self, images):
+        height, width = self.crop_size
+        max_a, max_b = images.shape[1] - height, images.shape[2] - width
+        if self.subset != 'training':
+            return images[:, max_a // 2:max_a // 2 + height, max_b // 2:max_b // 2 + width]
+        cropped = np.empty((len(images), height, width), dtype=np.uint8)
+        for i, image in enumerate(images):
+            a, b = random.randint(0, max_a), random.randint(0, max_b)
+            cropped[i] = image[a:a + height, b:b + width]
+        return cropped
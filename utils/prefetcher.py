@@ -0,0 +1,111 @@
+import time
+import random
+import multiprocessing
+import numpy as np
+from keras.callbacks import Callback
+from keras.utils import Sequence, to_categorical
+from utils.shared_buffer import SharedSlots
+
+worker_generator = None
+worker_slots = None
+
+
+class PrefetchingGenerator(Sequence):
+    def __init__(self, generator, num_workers=4, prefetch=4):
+        self.generator = generator
+        self.prefetch = prefetch
+        self.batch_shape = (generator.batch_size,) + generator.input_shape
+        slot_size = int(np.prod(self.batch_shape)) * np.dtype(np.float32).itemsize
+        # one float32 buffer per batch in flight plus the one currently used by the trainer, all of them reused
+        self.slots = SharedSlots(prefetch + 1, slot_size)
+        self.free_slots = list(range(prefetch + 1))
+        self.pending = dict()
+        self.current_slot = None
+        self.wait_time = 0
+        # spawn avoids forking the TensorFlow state of the trainer
+        context = multiprocessing.get_context('spawn')
+        self.pool = context.Pool(num_workers, initializer=init_worker, initargs=(generator, self.slots.name, slot_size))
+        self.schedule(0)
+
+    def __getitem__(self, idx):
+        if self.current_slot is not None:
+            # the previous batch has been handed over to the trainer by now, its buffer can be refilled
+            self.free_slots.append(self.current_slot)
+            self.current_slot = None
+        if idx not in self.pending:
+            # batches requested out of order are loaded on demand and prefetching continues after them
+            self.discard_pending()
+            self.schedule(idx)
+
+        slot, result = self.pending.pop(idx)
+        start = time.perf_counter()
+        batch_y = result.get()
+        self.wait_time += time.perf_counter() - start
+        self.current_slot = slot
+        self.schedule(idx + 1)
+        batch_x = self.slots.view(slot, self.batch_shape, np.float32)
+        return batch_x, to_categorical(batch_y, self.generator.num_classes)
+
+    def __len__(self):
+        return len(self.generator)
+
+    def on_epoch_end(self):
+        # batches of the next epoch are only scheduled once the generator has reshuffled its files
+        self.discard_pending()
+        if self.current_slot is not None:
+            self.free_slots.append(self.current_slot)
+            self.current_slot = None
+        self.generator.on_epoch_end()
+        self.schedule(0)
+
+    def schedule(self, start):
+        idx = start
+        while self.free_slots and idx < min(start + self.prefetch, len(self)):
+            if idx not in self.pending:
+                slot = self.free_slots.pop()
+                task = (slot, self.generator.batch_items(idx), random.getrandbits(32))
+                self.pending[idx] = (slot, self.pool.apply_async(load_batch, task))
+            idx += 1
+
+    def discard_pending(self):
+        for slot, result in self.pending.values():
+            result.wait()
+            self.free_slots.append(slot)
+        self.pending.clear()
+
+    def consume_wait_time(self):
+        wait_time, self.wait_time = self.wait_time, 0
+        return wait_time
+
+    def close(self):
+        self.discard_pending()
+        self.pool.close()
+        self.pool.join()
+        self.slots.close()
+
+
+class InputWaitLogger(Callback):
+    def __init__(self, generator):
+        super().__init__()
+        self.generator = generator
+
+    def on_epoch_end(self, epoch, logs=None):
+        # added to logs so that CSVLogger records it next to loss and accuracy
+        wait_time = self.generator.consume_wait_time()
+        if logs is not None:
+            logs['input_wait'] = wait_time
+        print('Epoch {}: waited {:.2f} s for input'.format(epoch + 1, wait_time))
+
+
+def init_worker(generator, shm_name, slot_size):
+    global worker_generator, worker_slots
+    worker_generator = generator
+    worker_slots = SharedSlots(0, slot_size, name=shm_name)
+
+
+def load_batch(slot, items, seed):
+    # workers start from the same random state, every batch is seeded so augmentations differ
+    random.seed(seed)
+    np.random.seed(seed)
+    batch_x = worker_slots.view(slot, (worker_generator.batch_size,) + worker_generator.input_shape, np.float32)
+    return worker_generator.load_batch(items, batch_x)
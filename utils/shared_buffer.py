@@ -0,0 +1,30 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class SharedSlots:
+    def __init__(self, num_slots, slot_size, name=None):
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=num_slots * slot_size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, slot, img):
+        if img.nbytes > self.slot_size:
+            raise ValueError('Image of {} bytes does not fit into slot of {} bytes'.format(img.nbytes, self.slot_size))
+        self.view(slot, img.shape, img.dtype)[...] = img
+
+    def view(self, slot, shape, dtype=np.uint8):
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=slot * self.slot_size)
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -1,83 +1,152 @@
 import io
+import os
+import mmap
+import struct
 import zipfile
+import zlib
 import numpy as np
 import random
 import cv2
 from PIL import Image
 from keras.utils import Sequence, to_categorical
 
-
-class FileData:
-    def __init__(self, label, file_path, zipfile_name):
-        self.label = label
-        self.file_path = file_path
-        self.zipfile_name = zipfile_name
+MANIFEST_VERSION = 1
 
 
 class DataHolder:
-    def __init__(self, zipfile_paths):
+    def __init__(self, zipfile_paths, use_manifest=True):
         self.zipfile_paths = zipfile_paths
-        self.zipfiles = self.open_zipfiles()
+        self.use_manifest = use_manifest
+        self.manifests = [self.load_manifest(path) for path in zipfile_paths]
         self.class_dict = self.map_class_labels()
-        self.files = self.map_file_structures()
-
-    def get_zipfile(self, key):
-        return self.zipfiles[key]
+        self.zip_indices, self.members, self.labels = self.map_file_structures()
+        # members are read straight from mapped zipfiles, central directories are not parsed again
+        self.mmaps = dict()
+        self.zipfiles = dict()
+
+    def __getstate__(self):
+        # open files cannot be pickled, processes receiving a copy open their own
+        state = self.__dict__.copy()
+        state['mmaps'] = dict()
+        state['zipfiles'] = dict()
+        return state
+
+    def get_zipfile(self, zip_idx):
+        if zip_idx not in self.zipfiles:
+            self.zipfiles[zip_idx] = zipfile.ZipFile(self.zipfile_paths[zip_idx], 'r')
+        return self.zipfiles[zip_idx]
+
+    def get_mmap(self, zip_idx):
+        if zip_idx not in self.mmaps:
+            with open(self.zipfile_paths[zip_idx], 'rb') as f:
+                self.mmaps[zip_idx] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mmaps[zip_idx]
 
     def get_class_num(self):
         return len(self.class_dict)
 
+    def get_file_num(self):
+        return len(self.labels)
+
     def get_files(self, subset):
         if subset not in ['training', 'validation']:
             raise ValueError('Invalid subset name: {}'.format(subset))
 
-        files = []
-        found_labels = set()
-        for f in self.files:
-            if subset == 'training':
-                if f.label in found_labels:
-                    files.append(f)
-                else:
-                    found_labels.add(f.label)
-            else:
-                if f.label not in found_labels:
-                    files.append(f)
-                    found_labels.add(f.label)
-
-        return files
+        # the first file of every class is used for validation, the rest for training
+        first = np.unique(self.labels, return_index=True)[1]
+        if subset == 'validation':
+            return np.sort(first)
+        training = np.ones(len(self.labels), dtype=bool)
+        training[first] = False
+        return np.flatnonzero(training)
+
+    def get_file_name(self, file_no):
+        manifest = self.manifests[self.zip_indices[file_no]]
+        start, end = manifest['name_offsets'][self.members[file_no]:self.members[file_no] + 2]
+        return manifest['names'][start:end].tobytes().decode('utf-8')
+
+    def read_file(self, file_no):
+        zip_idx, member = int(self.zip_indices[file_no]), int(self.members[file_no])
+        manifest = self.manifests[zip_idx]
+        compress_type = int(manifest['compress_types'][member])
+        if compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            return self.get_zipfile(zip_idx).read(self.get_file_name(file_no))
+
+        data = self.get_mmap(zip_idx)
+        offset = int(manifest['header_offsets'][member])
+        # name and extra field lengths of the local header may differ from those in the central directory
+        name_length, extra_length = struct.unpack_from('<HH', data, offset + 26)
+        start = offset + 30 + name_length + extra_length
+        raw = data[start:start + int(manifest['compress_sizes'][member])]
+        return raw if compress_type == zipfile.ZIP_STORED else zlib.decompress(raw, -15)
 
     def map_class_labels(self):
         class_dict = dict()
-        class_num = 0
-        for key, value in self.zipfiles.items():
-            cleaned_fnames = [x for x in value.namelist() if x.endswith('.jpg')]
-
-            for filename in cleaned_fnames:
-                class_label = self.get_parent_dir(filename)
+        for manifest in self.manifests:
+            for class_label in manifest['class_names'].tolist():
                 if class_label not in class_dict:
-                    class_dict[class_label] = class_num
-                    class_num += 1
+                    class_dict[class_label] = len(class_dict)
 
         print('Found {} classes total'.format(len(class_dict)))
         return class_dict
 
     def map_file_structures(self):
-        files = []
-        for key, value in self.zipfiles.items():
-            cleaned_fnames = [x for x in value.namelist() if x.endswith('.jpg')]
-
-            for filename in cleaned_fnames:
-                class_label = self.get_parent_dir(filename)
-                files.append(FileData(self.class_dict[class_label], filename, key))
-
-        print('Found {} files total'.format(len(files)))
-        return files
-
-    def open_zipfiles(self):
-        zipfiles = dict()
-        for zf_path in self.zipfile_paths:
-            zipfiles[zf_path] = zipfile.ZipFile(zf_path, 'r')
-        return zipfiles
+        zip_indices, members, labels = list(), list(), list()
+        for zip_idx, manifest in enumerate(self.manifests):
+            class_codes = np.array([self.class_dict[x] for x in manifest['class_names'].tolist()], dtype=np.int32)
+            labels.append(class_codes[manifest['labels']])
+            members.append(np.arange(len(manifest['labels']), dtype=np.int64))
+            zip_indices.append(np.full(len(manifest['labels']), zip_idx, dtype=np.int32))
+
+        labels = np.concatenate(labels) if labels else np.empty(0, dtype=np.int32)
+        print('Found {} files total'.format(len(labels)))
+        if not labels.size:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64), labels
+        return np.concatenate(zip_indices), np.concatenate(members), labels
+
+    def load_manifest(self, path):
+        manifest_path = path + '.manifest.npz'
+        stat = os.stat(path)
+        if self.use_manifest and os.path.exists(manifest_path):
+            with np.load(manifest_path) as data:
+                manifest = {key: data[key] for key in data.files}
+            # a zipfile changed since the manifest was written is scanned again
+            if int(manifest['version']) == MANIFEST_VERSION and int(manifest['mtime_ns']) == stat.st_mtime_ns \
+                    and int(manifest['size']) == stat.st_size:
+                return manifest
+
+        manifest = self.build_manifest(path)
+        manifest.update(version=MANIFEST_VERSION, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        if self.use_manifest:
+            try:
+                with open(manifest_path + '.tmp', 'wb') as f:
+                    np.savez(f, **manifest)
+                os.replace(manifest_path + '.tmp', manifest_path)
+            except OSError:
+                # e.g. read-only dataset directory, the zipfile is simply scanned on every start
+                pass
+        return manifest
+
+    def build_manifest(self, path):
+        with zipfile.ZipFile(path, 'r') as zf:
+            infos = [x for x in zf.infolist() if x.filename.endswith('.jpg')]
+        names = [x.filename.encode('utf-8') for x in infos]
+        parents = np.array([self.get_parent_dir(x.filename) for x in infos], dtype=str)
+        class_names, first, labels = np.unique(parents, return_index=True, return_inverse=True)
+        # classes are numbered in order of their first file, as they were before manifests existed
+        order = np.argsort(first)
+        rank = np.empty(len(order), dtype=np.int32)
+        rank[order] = np.arange(len(order), dtype=np.int32)
+        return {
+            'names': np.frombuffer(b''.join(names), dtype=np.uint8),
+            'name_offsets': np.cumsum([0] + [len(x) for x in names], dtype=np.int64),
+            'header_offsets': np.array([x.header_offset for x in infos], dtype=np.int64),
+            'compress_sizes': np.array([x.compress_size for x in infos], dtype=np.int64),
+            'file_sizes': np.array([x.file_size for x in infos], dtype=np.int64),
+            'compress_types': np.array([x.compress_type for x in infos], dtype=np.int16),
+            'class_names': class_names[order],
+            'labels': rank[labels.ravel()]
+        }
 
     def get_parent_dir(self, filepath):
         path = filepath.split('/')
@@ -92,32 +161,31 @@ class DataGenerator(Sequence):
         self.subset = subset
         self.data_holder = data_holder
         self.batch_size = batch_size
+        self.input_shape = (128, 128, 1)
+        self.num_classes = self.data_holder.get_class_num()
         self.files = self.data_holder.get_files(self.subset)
-        random.shuffle(self.files)
+        np.random.shuffle(self.files)
         print('{} subset length: {}'.format(self.subset, len(self.files)))
 
     def __getitem__(self, idx):
-        locations = self.files[idx * self.batch_size:(idx + 1) * self.batch_size]
-        batch_x = np.empty((self.batch_size, 128, 128, 1))
-        batch_y = np.empty(self.batch_size)
-
-        for i, loc in enumerate(locations):
-            batch_y[i] = loc.label
+        batch_x = np.empty((self.batch_size,) + self.input_shape, dtype=np.float32)
+        batch_y = self.load_batch(self.batch_items(idx), batch_x)
+        return batch_x, to_categorical(batch_y, self.num_classes)
 
-            zf = self.data_holder.get_zipfile(loc.zipfile_name)
-            with zf.open(loc.file_path) as imgfile:
-                imgdata = imgfile.read()
-            x_i = self.preprocess_image(imgdata)
-            batch_x[i] = x_i
+    def batch_items(self, idx):
+        return self.files[idx * self.batch_size:(idx + 1) * self.batch_size]
 
-        batch_y = to_categorical(batch_y, self.data_holder.get_class_num())
-        return batch_x, batch_y
+    def load_batch(self, file_nos, batch_x):
+        # fills the given buffer, so that callers can reuse it between batches
+        for i, file_no in enumerate(file_nos):
+            batch_x[i] = self.preprocess_image(self.data_holder.read_file(file_no))
+        return self.data_holder.labels[file_nos]
 
     def __len__(self):
         return len(self.files) // self.batch_size
 
     def on_epoch_end(self):
-        random.shuffle(self.files)
+        np.random.shuffle(self.files)
 
     def preprocess_image(self, imgdata):
         image = np.array(Image.open(io.BytesIO(imgdata)))
@@ -1,7 +1,9 @@
 from controller.frame_controller import FrameController
+from controller.frame_grabber import FrameGrabber
 from controller.identity_controller import IdentityController
 from model.identity_model import Identity
 import cv2
+import time
 from PIL import Image, ImageTk
 import tkinter as tk
 from tkinter import Tk, Canvas, Menu, Toplevel, Label, Entry, Button
@@ -13,6 +15,10 @@ PAD_X = 4
 PAD_Y = 4
 BUTTON_W = 8
 BUTTON_H = 1
+DISPLAY_FPS = 30
+IDLE_POLL_MS = 5
+OVERLAY_TAG = 'overlay'
+LABEL_FONT = ('Helvetica', 12)
 
 
 class UserInterface:
@@ -22,6 +28,13 @@ class UserInterface:
         camera_props = self.get_camera_props()
         self.frame_controller = FrameController(frame_proc_freq=camera_props[0])
         self.identity_controller = IdentityController()
+        self.grabber = FrameGrabber(self.camera)
+        self.frame_sequence = 0
+        self.frame_buffer = None
+        self.pil_image = None
+        self.photo = None
+        self.image_item = None
+        self.overlay_version = -1
 
         self.root = Tk()
         self.root.title('Main window')
@@ -46,37 +59,73 @@ class UserInterface:
         self.browse_button = None
         self.edit_button = None
         self.delete_button = None
+        self.add_photo_button = None
         self.img_path_label = None
 
     def run(self):
-        while self.running:
-            # img saved into variable to prevent deleting object from memory by garbage collector
-            img = self.capture_image()
-            self.root.update_idletasks()
-            self.root.update()
+        self.grabber.start()
+        self.frame_controller.start_detection(self.grabber)
+        self.root.after(0, self.update_frame)
+        self.root.mainloop()
 
     def stop(self):
+        self.grabber.stop()
         self.frame_controller.stop()
+        self.identity_controller.close()
 
     def on_closing(self):
-        self.running = False
+        self.quit()
 
     def quit(self):
         self.running = False
         self.root.quit()
 
+    def update_frame(self):
+        if not self.running:
+            return
+        sequence, frame = self.grabber.latest()
+        if frame is None or sequence == self.frame_sequence:
+            # no new camera frame yet, check again shortly instead of spinning
+            self.root.after(IDLE_POLL_MS, self.update_frame)
+            return
+        self.frame_sequence = sequence
+        start = time.perf_counter()
+        self.capture_image(frame)
+        elapsed_ms = int((time.perf_counter() - start) * 1000)
+        self.root.after(max(1000 // DISPLAY_FPS - elapsed_ms, 1), self.update_frame)
+
     def set_file_path(self):
         filename = filedialog.askopenfilename(initialdir="/", title="Select file",
                                               filetypes=(("jpeg files", "*.jpg"), ("all files", "*.*")))
         self.img_path_label['text'] = filename
 
-    def capture_image(self):
-        check, frame = self.camera.read()
-        processed_frame = self.frame_controller.process_frame(frame)
-        img = ImageTk.PhotoImage(image=Image.fromarray(processed_frame))
-        self.canvas.delete('all')
-        self.canvas.create_image(0, 0, image=img, anchor=tk.NW)
-        return img
+    def capture_image(self, frame):
+        buffer = self.frame_controller.process_frame(frame, draw_labels=False)
+        if buffer is not self.frame_buffer:
+            # PIL image shares memory with the controller's RGBA buffer, so it only has to be created once
+            self.frame_buffer = buffer
+            height, width = buffer.shape[:2]
+            self.pil_image = Image.frombuffer('RGBA', (width, height), buffer, 'raw', 'RGBA', 0, 1)
+            # photo saved into attribute to prevent deleting object from memory by garbage collector
+            self.photo = ImageTk.PhotoImage(image=self.pil_image)
+            if self.image_item is None:
+                self.image_item = self.canvas.create_image(0, 0, image=self.photo, anchor=tk.NW)
+            else:
+                self.canvas.itemconfig(self.image_item, image=self.photo)
+        else:
+            self.photo.paste(self.pil_image)
+        self.draw_overlays()
+
+    def draw_overlays(self):
+        version = self.frame_controller.overlay_version
+        if version == self.overlay_version:
+            return
+        self.overlay_version = version
+        self.canvas.delete(OVERLAY_TAG)
+        for (x, y, w, h), color, label in self.frame_controller.get_overlays():
+            color = '#{:02x}{:02x}{:02x}'.format(*color)
+            self.canvas.create_rectangle(x, y, x + w, y + h, outline=color, tags=OVERLAY_TAG)
+            self.canvas.create_text(x, y - 5, text=label, fill=color, anchor=tk.SW, font=LABEL_FONT, tags=OVERLAY_TAG)
 
     def get_camera_props(self):
         frame_proc_freq = max(int(self.camera.get(cv2.CAP_PROP_FPS) // 10), 1)
@@ -97,6 +146,7 @@ class UserInterface:
             self.surname_entry.insert(0, item['values'][1])
             self.edit_button['state'] = tk.NORMAL
             self.delete_button['state'] = tk.NORMAL
+            self.add_photo_button['state'] = tk.NORMAL
         else:
             self.clear_entries()
 
@@ -123,6 +173,16 @@ class UserInterface:
                 messagebox.showwarning('Warning', str(e))
             self.refresh_table()
 
+    def add_photo(self):
+        selected = self.tree.focus()
+        if selected:
+            item = self.tree.item(selected)
+            try:
+                self.identity_controller.add_photo(int(item['text']), self.img_path_label['text'])
+            except ValueError as e:
+                messagebox.showwarning('Warning', str(e))
+            self.refresh_table()
+
     def delete_identity(self):
         selected = self.tree.focus()
         if selected:
@@ -157,6 +217,8 @@ class UserInterface:
         self.edit_button.grid(row=1, column=3, sticky=tk.E, padx=PAD_X, pady=PAD_Y)
         self.delete_button = Button(self.window, text='Delete', command=self.delete_identity, height=BUTTON_H, width=BUTTON_W, state=tk.DISABLED)
         self.delete_button.grid(row=2, column=3, sticky=tk.E, padx=PAD_X, pady=PAD_Y)
+        self.add_photo_button = Button(self.window, text='Add photo', command=self.add_photo, height=BUTTON_H, width=BUTTON_W, state=tk.DISABLED)
+        self.add_photo_button.grid(row=3, column=3, sticky=tk.E, padx=PAD_X, pady=PAD_Y)
         self.show_table()
 
     def show_table(self):
@@ -183,4 +245,5 @@ class UserInterface:
         self.surname_entry.delete(0, tk.END)
         self.edit_button['state'] = tk.DISABLED
         self.delete_button['state'] = tk.DISABLED
+        self.add_photo_button['state'] = tk.DISABLED
         self.img_path_label['text'] = ''